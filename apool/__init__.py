@@ -8,20 +8,25 @@ __copyright__ = u'2021 Pierre Delaunay'
 __url__ = 'https://github.com/kiwi-lang/python_seed'
 
 
+from apool.backends.asyncio import AsyncioPool, AsyncioExecutor
 from apool.backends.dask import DaskPool, DaskExecutor
 from apool.backends.multiprocess import ProcessPool, ProcessExecutor
+from apool.backends.stealing import WorkStealingPool, WorkStealingExecutor
 from apool.backends.thread import ThreadPool, ThreadExecutor
+from apool.worker import worker_state
 
 Process = 0
 Thread = 1
 Dask = 2
+Asyncio = 3
+WorkStealing = 4
 
 
 
 def Pool(cls, *args, **kwargs):
-    bks = [ProcessPool, ThreadPool, DaskPool]
+    bks = [ProcessPool, ThreadPool, DaskPool, AsyncioPool, WorkStealingPool]
     return bks[cls](*args, **kwargs)
 
 def Executor(cls, *args, **kwargs):
-    bks = [ProcessExecutor, ThreadExecutor, DaskExecutor]
+    bks = [ProcessExecutor, ThreadExecutor, DaskExecutor, AsyncioExecutor, WorkStealingExecutor]
     return bks[cls](*args, **kwargs)
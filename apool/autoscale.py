@@ -0,0 +1,152 @@
+"""Grow and shrink the number of workers of a pool with its load
+
+Supported by the process and thread backends.
+
+Examples
+--------
+
+>>> import time
+>>> from apool import Pool, Thread
+>>> from apool.autoscale import Autoscale
+>>> from apool.testing import slow_inc
+
+>>> events = []
+>>> config = Autoscale(1, 4, scale_up_latency=0.01, idle_timeout=0.05, on_event=events.append)
+
+>>> with Pool(Thread, None, autoscale=config) as p:
+...     p.starmap(slow_inc, [(i, 0.05) for i in range(16)])
+...     time.sleep(0.5)
+[1, 2, 3, 4, 5, 6, 7, 8, 9, 10, 11, 12, 13, 14, 15, 16]
+>>> [e.action for e in events][0], [e.action for e in events][-1], events[-1].new
+('up', 'down', 1)
+
+"""
+from collections import OrderedDict, namedtuple
+from itertools import islice
+import os
+from threading import Event, Lock, Thread
+import time
+
+
+ScaleEvent = namedtuple('ScaleEvent', ['time', 'action', 'old', 'new', 'reason'])
+ScaleEvent.__doc__ = """Scaling decision, ``action`` is ``'up'`` or ``'down'``"""
+
+
+class Autoscale:
+    """Configuration of an adaptive pool
+
+    Parameters
+    ----------
+    min_workers: int
+        the pool never has less workers
+
+    max_workers: int
+        the pool never has more workers, defaults to the number of cpus
+
+    scale_up_latency: float
+        add workers when the oldest queued task has been waiting for longer (s)
+
+    idle_timeout: float
+        remove workers that have been idle for longer (s)
+
+    interval: float
+        time between two scaling decisions (s)
+
+    on_event: callable
+        called with a :class:`ScaleEvent` for each scaling decision
+    """
+
+    def __init__(self, min_workers=1, max_workers=None, scale_up_latency=0.1, idle_timeout=60.0,
+                 interval=0.05, on_event=None):
+        if max_workers is None:
+            max_workers = max(os.cpu_count() or 1, min_workers)
+
+        if not 1 <= min_workers <= max_workers:
+            raise ValueError('expected 1 <= min_workers <= max_workers')
+
+        self.min_workers = min_workers
+        self.max_workers = max_workers
+        self.scale_up_latency = scale_up_latency
+        self.idle_timeout = idle_timeout
+        self.interval = interval
+        self.on_event = on_event
+
+    def initial_workers(self, n_workers):
+        """Number of workers to start with"""
+        if n_workers is None:
+            return self.min_workers
+
+        return min(max(n_workers, self.min_workers), self.max_workers)
+
+
+class _Autoscaler:
+    """Watches the tasks of a pool and resizes it from a background thread.
+
+    Tasks are assumed to start in submission order, so the tasks past
+    the first ``size`` unfinished ones are the queued ones.
+    """
+
+    def __init__(self, config, resize, size):
+        self.config = config
+        self.resize = resize
+        self.size = size
+        self.lock = Lock()
+        self.pending = OrderedDict()
+        self.idle_since = None
+        self.stopped = Event()
+        self.thread = Thread(target=self._run, name='apool-autoscale', daemon=True)
+        self.thread.start()
+
+    def track(self, future):
+        """Account for a newly submitted task, returns the future"""
+        key = object()
+
+        with self.lock:
+            self.pending[key] = time.monotonic()
+
+        def done(_):
+            with self.lock:
+                self.pending.pop(key, None)
+
+        future.add_done_callback(done)
+        return future
+
+    def _run(self):
+        while not self.stopped.wait(self.config.interval):
+            self.step(time.monotonic())
+
+    def step(self, now):
+        config = self.config
+
+        with self.lock:
+            inflight = len(self.pending)
+            oldest = next(islice(self.pending.values(), self.size, None), None)
+
+        if oldest is not None and now - oldest > config.scale_up_latency:
+            self.idle_since = None
+
+            if self.size < config.max_workers:
+                reason = f'a task was queued for {now - oldest:.3f}s'
+                self._scale('up', min(inflight, config.max_workers), reason)
+
+        elif inflight < self.size:
+            if self.idle_since is None:
+                self.idle_since = now
+
+            elif now - self.idle_since >= config.idle_timeout and self.size > config.min_workers:
+                reason = f'{self.size - inflight} workers idle for {now - self.idle_since:.3f}s'
+                self._scale('down', max(inflight, config.min_workers), reason)
+                self.idle_since = now
+
+        else:
+            self.idle_since = None
+
+    def _scale(self, action, size, reason):
+        old, self.size = self.size, size
+        self.resize(size)
+
+        if self.config.on_event is not None:
+            self.config.on_event(ScaleEvent(time.time(), action, old, size, reason))
+
+    def close(self):
+        self.stopped.set()
@@ -0,0 +1,300 @@
+import asyncio
+from functools import partial
+import os
+from threading import Thread
+from types import SimpleNamespace
+
+from apool.backends.thread import _ThreadFuture
+from apool.graph import _DeferredFuture, _has_futures
+from apool.interfaces import Future, Pool, Executor
+from apool.metrics import _make_metrics, _run, _run_async
+from apool.utils import _make_limiter
+from apool.worker import _call_with_state, _local
+
+
+class _AsyncioFuture(_ThreadFuture):
+    """Future of a task running on the loop, the task is cancelled when it is not started yet
+    or when ``interrupt`` is true, coroutines are then interrupted at their next ``await``"""
+
+    __slots__ = ('started',)
+
+    def __init__(self, future=None):
+        super().__init__(future)
+        self.started = False
+
+    def cancel(self, interrupt=False):
+        if self.started and not interrupt:
+            return False
+
+        return self.future.cancel()
+
+
+class _EventLoop:
+    """Runs tasks on an event loop living in a background thread,
+    at most ``n_workers`` tasks run concurrently.
+
+    Coroutine functions are awaited on the loop, regular functions
+    are executed in the default executor of the loop so they do not block it.
+
+    Parameters
+    ----------
+    n_workers: int
+        maximum number of tasks running concurrently, defaults to the number of threads
+        of the default executor of the loop, ``min(32, os.cpu_count() + 4)``
+
+    loop: asyncio.AbstractEventLoop
+        loop to use, it must be running in another thread.
+        If None a new loop is created
+
+    metrics: Metrics
+        collect metrics about the tasks
+
+    initializer: callable
+        function or coroutine function called with ``initargs`` on the loop before the first task
+
+    initargs: tuple
+        arguments of the initializer
+
+    warmup: bool
+        block until the initializer is done
+
+    max_pending: int
+        maximum number of tasks submitted and not finished yet, submitting more blocks.
+        Tasks must not be submitted from the loop itself
+
+    submit_timeout: float
+        time to wait for a task to finish when ``max_pending`` are pending,
+        0 raises :class:`queue.Full` right away and None waits forever
+
+    Notes
+    -----
+    The loop is the worker, all its tasks share the same :func:`apool.worker_state`.
+    """
+
+    def __init__(self, n_workers, loop=None, metrics=None, initializer=None, initargs=(), warmup=False,
+                 max_pending=None, submit_timeout=None):
+        if n_workers is None:
+            # regular functions run on the default executor, it starts as many threads
+            n_workers = min(32, (os.cpu_count() or 1) + 4)
+
+        self.n_workers = n_workers
+        self.metrics = metrics
+        self.limiter = _make_limiter(max_pending, submit_timeout)
+        self.semaphore = None
+        self.thread = None
+        self.loop = loop
+        self.state = SimpleNamespace()
+
+        if loop is None:
+            self.loop = asyncio.new_event_loop()
+            self.thread = Thread(target=self._run, name='apool-asyncio', daemon=True)
+            self.thread.start()
+
+        self.setup = asyncio.run_coroutine_threadsafe(self._setup(initializer, initargs), self.loop)
+
+        if warmup:
+            try:
+                self.setup.result()
+            except BaseException:
+                self.shutdown(wait=False)
+                raise
+
+    def _run(self):
+        asyncio.set_event_loop(self.loop)
+        try:
+            self.loop.run_forever()
+        finally:
+            self.loop.close()
+
+    async def _setup(self, initializer, initargs):
+        _local.state = self.state
+
+        if initializer is None:
+            return
+
+        if asyncio.iscoroutinefunction(initializer):
+            await initializer(*initargs)
+        else:
+            initializer(*initargs)
+
+    async def _execute(self, fun, args, kwds, record, future):
+        # tasks fail if the initializer failed
+        if not self.setup.done():
+            await asyncio.wrap_future(self.setup)
+
+        self.setup.result()
+
+        # created on the loop so it is bound to it
+        if self.semaphore is None:
+            self.semaphore = asyncio.Semaphore(self.n_workers)
+
+        async with self.semaphore:
+            future.started = True
+
+            if asyncio.iscoroutinefunction(fun):
+                if record is not None:
+                    return await _run_async(record, fun, args, kwds)
+
+                return await fun(*args, **kwds)
+
+            if record is not None:
+                fun, args, kwds = _run, (record, fun, args, kwds), dict()
+
+            task = partial(_call_with_state, self.state, fun, *args, **kwds)
+            return await self.loop.run_in_executor(None, task)
+
+    async def _stop(self, cancel):
+        tasks = [t for t in asyncio.all_tasks() if t is not asyncio.current_task()]
+
+        if cancel:
+            for task in tasks:
+                task.cancel()
+
+        await asyncio.gather(*tasks, return_exceptions=True)
+        self.loop.stop()
+
+    def submit(self, fun, args, kwds):
+        if self.limiter is not None:
+            return self.limiter(self._submit, fun, args, kwds)
+
+        return self._submit(fun, args, kwds)
+
+    def _submit(self, fun, args, kwds):
+        if _has_futures(args, kwds):
+            return _DeferredFuture(lambda args, kwds: self._submit(fun, args, kwds), args, kwds)
+
+        record = None if self.metrics is None else self.metrics._submit(fun)
+        future = _AsyncioFuture()
+        future.future = asyncio.run_coroutine_threadsafe(self._execute(fun, args, kwds, record, future), self.loop)
+
+        if record is not None:
+            self.metrics._observe(record, future)
+
+        return future
+
+    def shutdown(self, wait=True, cancel=False):
+        """Stop the loop once its tasks are done, only loops created by us are stopped"""
+        if self.thread is None or not self.thread.is_alive():
+            return
+
+        asyncio.run_coroutine_threadsafe(self._stop(cancel), self.loop)
+
+        if wait:
+            self.thread.join()
+
+
+class AsyncioExecutor(Executor):
+    """Executor running coroutine functions on an event loop
+
+    Examples
+    --------
+
+    >>> from apool import Executor, Asyncio
+    >>> from apool.testing import async_inc
+
+    >>> with Executor(Asyncio, 5) as p:
+    ...     future = p.submit(async_inc, 1)
+    ...     future.get()
+    2
+
+    """
+
+    def __init__(self, n_workers, loop=None, metrics=None, initializer=None, initargs=(), warmup=False,
+                 max_pending=None, submit_timeout=None):
+        self.metrics = _make_metrics(metrics)
+        self.loop = _EventLoop(
+            n_workers, loop, self.metrics, initializer, initargs, warmup, max_pending, submit_timeout
+        )
+
+    def submit(self, fn, *args, **kwargs):
+        """
+
+        Examples
+        --------
+
+        >>> from apool import Executor, Asyncio
+        >>> from apool.testing import fun
+
+        >>> with Executor(Asyncio, 5) as p:
+        ...     future = p.submit(fun, 1, 2, c=3, d=4) 
+        ...     future.get()
+        10
+        
+        """
+        return self.loop.submit(fn, args, kwargs)
+
+    def map_async(self, func, *iterables, timeout=None, chunksize=1):
+        # tasks have no transfer cost, chunking would only limit the concurrency
+        return super().map_async(func, *iterables, timeout=timeout, chunksize=1)
+
+    def shutdown(self, wait=True, *, cancel_futures=False):
+        return self.loop.shutdown(wait, cancel_futures)
+
+
+class AsyncioPool(Pool):
+    """Pool running coroutine functions on an event loop,
+    ``n_workers`` is the maximum number of coroutines running concurrently.
+    ``chunksize`` arguments are ignored.
+
+    Examples
+    --------
+
+    >>> from apool import Pool, Asyncio
+    >>> from apool.testing import async_inc
+
+    >>> with Pool(Asyncio, 5) as p:
+    ...     p.map(async_inc, (1, 2, 3, 4))
+    [2, 3, 4, 5]
+
+    Without ``n_workers`` the concurrency is the default number of threads of the loop executor
+
+    >>> import os
+    >>> with Pool(Asyncio, None) as p:
+    ...     p.map(async_inc, (1, 2)), p.n_workers == min(32, os.cpu_count() + 4)
+    ([2, 3], True)
+
+    """
+
+    def __init__(self, n_workers, loop=None, metrics=None, initializer=None, initargs=(), warmup=False,
+                 max_pending=None, submit_timeout=None):
+        self.metrics = _make_metrics(metrics)
+        self.loop = _EventLoop(
+            n_workers, loop, self.metrics, initializer, initargs, warmup, max_pending, submit_timeout
+        )
+        self.n_workers = self.loop.n_workers
+
+    def apply_async(self, fun, args, kwds=None) -> Future:
+        """
+
+        Examples
+        --------
+
+        >>> from apool import Pool, Asyncio
+        >>> from apool.testing import fun
+
+        >>> with Pool(Asyncio, 5) as p:
+        ...     future = p.apply_async(fun, (1, 2), dict(c=3, d=4)) 
+        ...     future.get()
+        10
+        
+        """
+        if kwds is None:
+            kwds = dict()
+
+        return self.loop.submit(fun, args, kwds)
+
+    def _submit_chunks(self, func, iterable, chunksize, ordered, speculative=None):
+        # tasks have no transfer cost, chunking would only limit the concurrency
+        return super()._submit_chunks(func, iterable, 1, ordered, speculative)
+
+    def _submit_lazy(self, func, iterable, chunksize, max_inflight, ordered, speculative=None):
+        return super()._submit_lazy(func, iterable, 1, max_inflight, ordered, speculative)
+
+    def close(self):
+        self.loop.shutdown(wait=False)
+
+    def terminate(self):
+        self.loop.shutdown(cancel=True)
+
+    def join(self):
+        self.loop.shutdown()
@@ -1,24 +1,57 @@
+from concurrent.futures import CancelledError
 import traceback
 from multiprocessing import TimeoutError as PyTimeoutError
 from multiprocessing import Value
+from operator import getitem
+from threading import Thread, current_thread
+from types import SimpleNamespace
+import uuid
 
+from apool.graph import _DeferredFuture, _has_futures
 from apool.interfaces import Future, Pool, Executor, FutureArray
+from apool.metrics import _make_metrics, _run
+from apool.utils import _chunks, _make_limiter, _map_chunk
+from apool.worker import _call_with_state
 
 try:
     from dask.distributed import (
         Client,
         TimeoutError,
+        WorkerPlugin,
         get_client,
         get_worker,
         rejoin,
         secede,
     )
+    from dask.distributed import wait as _wait
 
     HAS_DASK = None
 except ImportError as e:
     HAS_DASK = e
 
 
+if not HAS_DASK:
+    class _Initializer(WorkerPlugin):
+        """Run the initializer on every worker, including the ones joining later"""
+
+        def __init__(self, initializer, initargs):
+            self.initializer = initializer
+            self.initargs = initargs
+
+        def setup(self, worker):
+            worker.apool_state = SimpleNamespace()
+            _call_with_state(worker.apool_state, self.initializer, *self.initargs)
+
+
+def _setup_workers(client, initializer, initargs, warmup):
+    if warmup:
+        client.wait_for_workers(1)
+
+    if initializer is not None:
+        # blocks until the current workers have run the initializer
+        client.register_plugin(_Initializer(initializer, initargs), name=f'apool-{uuid.uuid4().hex}')
+
+
 class _DaskFuture(Future):
     """Wraps a Dask Future
     
@@ -52,8 +85,12 @@ class _DaskFuture(Future):
 
     """
 
-    def __init__(self, future):
+    __slots__ = ('future', 'parts')
+
+    def __init__(self, future, parts=()):
         self.future = future
+        # other futures of the task, cancelled with it
+        self.parts = parts
 
     def get(self, timeout=None):
         
@@ -64,8 +101,8 @@ class _DaskFuture(Future):
 
     def wait(self, timeout=None):
         try:
-            self.future.result(timeout)
-        except TimeoutError:
+            _wait([self.future], timeout)
+        except (TimeoutError, CancelledError):
             pass
 
     def ready(self):
@@ -75,20 +112,122 @@ class _DaskFuture(Future):
         if not self.future.done():
             raise ValueError()
 
-        return self.future.exception() is None
+        return self.future.status == 'finished'
+
+    def add_done_callback(self, fn):
+        # dask runs the callback in its own thread once the task is done
+        self.future.add_done_callback(lambda _: fn(self))
+
+    def cancel(self, interrupt=False):
+        # the scheduler forgets the task, a worker running it still finishes it
+        if self.future.done():
+            return False
+
+        self.future.client.cancel([self.future, *self.parts])
+        return True
+
+    def cancelled(self):
+        return self.future.cancelled()
+
+
+def _run_remote(record, fun, args, kwargs):
+    # a dask worker runs multiple threads
+    value = _run(record, fun, args, kwargs, f'{get_worker().address} {current_thread().name}')
+    return value, record
+
+
+def _track(pending, future):
+    """Keep ``future`` in ``pending`` until it is done, returns the future"""
+    pending.add(future)
+    future.add_done_callback(pending.discard)
+    return future
+
+
+def _native(args):
+    """Replace our futures by the dask futures they wrap, dask waits for them on its own"""
+    return tuple(arg.future if isinstance(arg, _DaskFuture) else arg for arg in args)
+
+
+def _submit(client, metrics, fun, args, kwds, limiter=None, **options):
+    if limiter is not None:
+        return limiter(_submit, client, metrics, fun, args, kwds, **options)
+
+    if _has_futures(args, kwds):
+        args, kwds = _native(args), dict(zip(kwds, _native(kwds.values())))
+
+        # futures of other pools are waited on here
+        if _has_futures(args, kwds):
+            return _DeferredFuture(lambda args, kwds: _submit(client, metrics, fun, args, kwds, **options), args, kwds)
+
+    if metrics is None:
+        return _DaskFuture(client.submit(fun, *args, **kwds, **options))
+
+    # the record is a separate output so the result future stays a plain dask future
+    record = metrics._submit(fun)
+    pair = client.submit(_run_remote, record, fun, args, kwds, pure=False)
+    remote = client.submit(getitem, pair, 1)
+
+    def done(future):
+        if future.cancelled():
+            return metrics._cancel(record)
+
+        failed = future.status != 'finished'
+
+        if not failed:
+            record.merge(future.result())
+
+        metrics._done(record, failed)
+
+    remote.add_done_callback(done)
+    return _DaskFuture(client.submit(getitem, pair, 0), (pair, remote))
 
 
 class DaskExecutor(Executor):
-    
-    def __init__(self, n_workers, client=None, **config):
+    """Executor running the tasks on a dask cluster
+
+    Parameters
+    ----------
+    n_workers: int
+        number of concurrent tasks, defaults to the number of threads of the cluster
+
+    client: Client
+        dask client to use, if None a new client is created using ``config``
+
+    metrics: bool or Metrics
+        collect metrics about the tasks, see :class:`apool.metrics.Metrics`
+
+    initializer: callable
+        called with ``initargs`` on every dask worker, see :func:`apool.worker_state`
+
+    initargs: tuple
+        arguments of the initializer
+
+    warmup: bool
+        wait for the cluster to have a worker, the current workers
+        always run the initializer before the pool is returned
+
+    max_pending: int
+        maximum number of tasks submitted and not finished yet, submitting more blocks
+
+    submit_timeout: float
+        time to wait for a task to finish when ``max_pending`` are pending,
+        0 raises :class:`queue.Full` right away and None waits forever
+    """
+
+    def __init__(self, n_workers, client=None, metrics=None, initializer=None, initargs=(),
+                 warmup=False, max_pending=None, submit_timeout=None, **config):
         if HAS_DASK:
             raise HAS_DASK
 
+        self.metrics = _make_metrics(metrics)
+        self.limiter = _make_limiter(max_pending, submit_timeout)
         self.config = config
         if client is None:
             client = Client(**self.config)
 
         self.client = client
+        self.pending = set()
+        _setup_workers(client, initializer, initargs, warmup)
 
     def submit(self, fn, *args, **kwargs):
         """
@@ -105,7 +244,13 @@ class DaskExecutor(Executor):
         10
         
         """
-        return _DaskFuture(self.client.submit(fn, *args, **kwargs))
+        return _track(self.pending, _submit(self.client, self.metrics, fn, args, kwargs, self.limiter))
+
+    def broadcast(self, obj):
+        """Returns a future of ``obj`` copied to every worker with ``client.scatter(broadcast=True)``,
+        dask replaces it by ``obj`` in the arguments of the tasks, lists, tuples and dicts included
+        """
+        return self.client.scatter([obj], broadcast=True)[0]
 
     def map_async(self, func, *iterables, timeout=None, chunksize=1):
         """
@@ -120,24 +265,106 @@ class DaskExecutor(Executor):
         ...     futures = p.map_async(add, [1, 2, 3, 4], [1, 2, 3, 4]) 
         ...     list(futures.get())
         [2, 4, 6, 8]
+
+        >>> with Executor(Dask, 5) as p:
+        ...     futures = p.map_async(add, [1, 2, 3, 4], [1, 2, 3, 4], chunksize=3)
+        ...     futures.get()
+        [2, 4, 6, 8]
         
         """
-        return FutureArray([_DaskFuture(f) for f in self.client.map(func, *iterables)])
+        if chunksize > 1:
+            chunks = _chunks(zip(*iterables), chunksize)
+            futures = [
+                _track(
+                    self.pending,
+                    _submit(self.client, self.metrics, _map_chunk, (func, chunk), dict(), self.limiter, pure=False)
+                )
+                for chunk in chunks
+            ]
+            return FutureArray(futures, chunked=True)
+
+        if self.metrics is not None or self.limiter is not None:
+            return super().map_async(func, *iterables, timeout=timeout)
+
+        return FutureArray([_track(self.pending, _DaskFuture(f)) for f in self.client.map(func, *iterables)])
 
     def shutdown(self, wait=True, *, cancel_futures=False):
-        return self.client.shutdown()
+        """Shutdown the client once the pending tasks are done
+
+        Parameters
+        ----------
+        wait: bool
+            block until the pending tasks are done, else they finish in the background
+
+        cancel_futures: bool
+            cancel the pending tasks
+        """
+        pending = list(self.pending)
+
+        if cancel_futures:
+            for future in pending:
+                future.cancel()
+
+        if wait:
+            self._finalize(pending)
+        else:
+            Thread(target=self._finalize, args=(pending,), name='apool-shutdown', daemon=True).start()
+
+    def _finalize(self, pending):
+        for future in pending:
+            future.wait()
+
+        self.client.shutdown()
 
 
 class DaskPool(Pool):
-    def __init__(self, n_workers=None, client=None, **config):
+    """Pool running the tasks on a dask cluster
+
+    Parameters
+    ----------
+    n_workers: int
+        number of concurrent tasks, defaults to the number of threads of the cluster
+
+    client: Client
+        dask client to use, if None a new client is created using ``config``
+
+    metrics: bool or Metrics
+        collect metrics about the tasks, see :class:`apool.metrics.Metrics`
+
+    initializer: callable
+        called with ``initargs`` on every dask worker, see :func:`apool.worker_state`
+
+    initargs: tuple
+        arguments of the initializer
+
+    warmup: bool
+        wait for the cluster to have a worker, the current workers
+        always run the initializer before the pool is returned
+
+    max_pending: int
+        maximum number of tasks submitted and not finished yet, submitting more blocks
+
+    submit_timeout: float
+        time to wait for a task to finish when ``max_pending`` are pending,
+        0 raises :class:`queue.Full` right away and None waits forever
+    """
+
+    REMOTE_RESULTS = True
+
+    def __init__(self, n_workers=None, client=None, metrics=None, initializer=None, initargs=(),
+                 warmup=False, max_pending=None, submit_timeout=None, **config):
         if HAS_DASK:
             raise HAS_DASK
 
+        self.metrics = _make_metrics(metrics)
+        self.limiter = _make_limiter(max_pending, submit_timeout)
         self.config = config
         if client is None:
             client = Client(**self.config)
 
         self.client = client
+        self.n_workers = n_workers or sum(client.nthreads().values())
+        _setup_workers(client, initializer, initargs, warmup)
 
     def apply_async(self, fun, args, kwds=None) -> Future:
         """
@@ -157,7 +384,25 @@ class DaskPool(Pool):
         if kwds is None:
             kwds = dict()
         
-        return _DaskFuture(self.client.submit(fun, *args, **kwds, pure=False))
+        return _submit(self.client, self.metrics, fun, args, kwds, self.limiter, pure=False)
+
+    def broadcast(self, obj):
+        """Returns a future of ``obj`` copied to every worker with ``client.scatter(broadcast=True)``,
+        dask replaces it by ``obj`` in the arguments of the tasks, lists, tuples and dicts included
+
+        Examples
+        --------
+
+        >>> from apool import Pool, Dask
+        >>> from apool.testing import add
+
+        >>> with Pool(Dask, 2) as p:
+        ...     table = p.broadcast(10)
+        ...     p.starmap(add, [(1, table), (2, table)])
+        [11, 12]
+
+        """
+        return self.client.scatter([obj], broadcast=True)[0]
 
     def close(self):
         self.client.shutdown()
@@ -1,13 +1,33 @@
-from multiprocessing import Manager, Process
-from multiprocessing.pool import AsyncResult
+from concurrent.futures import CancelledError
+from importlib import import_module
+from multiprocessing import TimeoutError, context, get_context
+from multiprocessing.pool import CLOSE, RUN, AsyncResult
 from multiprocessing.pool import Pool as PyPool
+from multiprocessing.queues import SimpleQueue
+import os
 import pickle
+from threading import Lock, Thread
+import time
 
+from apool.autoscale import _Autoscaler
+from apool.graph import _DeferredFuture, _has_futures
 from apool.interfaces import Future, Pool, Executor
-from apool.utils import _cloudpickle, _payload
+from apool.metrics import _make_metrics, _Result
+from apool.utils import _call, _dumps, _FunctionRegistry, _loads, _make_limiter, _pickle, _Store, _task_record
+from apool.worker import _initialize
 
 
-class _Process(Process):
+# Buffers larger than this are sent through shared memory when enabled
+SHARED_MEMORY_THRESHOLD = 1024 * 1024
+
+# Jobs are tracked in this many shared slots so they can be cancelled once sent
+JOB_SLOTS = 1 << 14
+
+# Maximum number of workers whose running job is tracked, they are found by pid
+WORKER_SLOTS = 1024
+
+
+class _NonDaemonic:
     """Process that cannot be a daemon"""
 
     def _get_daemon(self):
@@ -19,7 +39,61 @@ class _Process(Process):
     daemon = property(_get_daemon, _set_daemon)
 
 
-class _Future:
+# one subclass per start method, they need to be importable for spawn and forkserver
+_NON_DAEMONIC = dict()
+
+for _name in ('ForkProcess', 'SpawnProcess', 'ForkServerProcess'):
+    if hasattr(context, _name):
+        _base = getattr(context, _name)
+        _NON_DAEMONIC[_base] = globals()[f'_{_name}'] = type(
+            f'_{_name}', (_NonDaemonic, _base), dict(__module__=__name__)
+        )
+
+
+def _get_context(ctx, preload=()):
+    """Returns the multiprocessing context to use, ``ctx`` is None, a start method name or a context.
+
+    Preloaded modules are imported by the fork server, by the parent before forking
+    or by the workers when they start with spawn. The fork server is shared by every pool
+    and only imports the modules known when it starts, workers import the others themselves.
+    Returns the context and the modules the workers still need to import.
+    """
+    if ctx is None or isinstance(ctx, str):
+        ctx = get_context(ctx)
+
+    preload = list(preload)
+    method = ctx.get_start_method()
+
+    if method == 'spawn':
+        return ctx, preload
+
+    if method == 'fork':
+        for module in preload:
+            import_module(module)
+
+        return ctx, []
+
+    # the workers run our code, let the server import it once for all of them
+    preload.insert(0, __name__)
+
+    from multiprocessing import forkserver
+
+    server = forkserver._forkserver
+    current = list(server._preload_modules)
+    missing = [m for m in preload if m not in current]
+
+    if not missing:
+        return ctx, []
+
+    # a running server cannot be restarted while pools use it
+    if getattr(server, '_forkserver_pid', None) is not None:
+        return ctx, missing
+
+    ctx.set_forkserver_preload(current + missing)
+    return ctx, []
+
+
+class _Future(Future):
     """Wraps a python AsyncResult
     
     Examples
@@ -51,51 +125,726 @@ class _Future:
 
     """
 
-    def __init__(self, future, cloudpickle=False):
+    __slots__ = ('future', 'pool', 'result', 'callbacks', 'record')
+
+    # callbacks are registered and fired under this lock, it is shared
+    # by all the futures because critical sections are tiny
+    _lock = Lock()
+
+    def __init__(self, future=None, pool=None):
         self.future = future
-        self.cloudpickle = cloudpickle
+        self.pool = pool
+        self.result = None
+        self.callbacks = []
+        self.record = None
+
+    def _on_success(self, value):
+        if isinstance(value, _Result):
+            self.record.merge(value.record)
+
+            if value.failed:
+                return self._set_result((False, value.value))
+
+            value = value.value
+
+        self._set_result((True, value))
+
+    def _on_error(self, exception):
+        self._set_result((False, exception))
+
+    def _set_result(self, result):
+        # Called by the pool result handler thread before ``AsyncResult.get``
+        # unblocks, the result is saved so callbacks can call ``get`` safely
+        with self._lock:
+            # cancelled futures are done before their job comes back
+            if self.callbacks is None:
+                return
+
+            self.result = result
+            callbacks, self.callbacks = self.callbacks, None
+
+        for callback in callbacks:
+            callback(self)
 
     def get(self, timeout=None):
-        r = self.future.get(timeout)
-        return pickle.loads(r) if self.cloudpickle else r
+        if self.result is None:
+            # callbacks run before the AsyncResult is marked as ready
+            self.future.wait(timeout)
+
+            if self.result is None:
+                raise TimeoutError
+
+        success, r = self.result
+
+        if not success:
+            raise r
+
+        return r
 
     def wait(self, timeout=None):
-        return self.future.wait(timeout)
+        if self.result is None:
+            return self.future.wait(timeout)
 
     def ready(self):
-        return self.future.ready()
+        return self.result is not None or self.future.ready()
 
     def successful(self):
-        return self.future.successful()
+        if self.result is None:
+            return self.future.successful()
+
+        return self.result[0]
+
+    def add_done_callback(self, fn):
+        with self._lock:
+            if self.result is None:
+                self.callbacks.append(fn)
+                return
+
+        fn(self)
+
+    def cancel(self, interrupt=False):
+        if self.result is not None:
+            return False
+
+        job = self.future._job
+
+        # running jobs are interrupted by killing their worker
+        if not self.pool._cancel(job) and not (interrupt and self.pool._kill(job, CancelledError())):
+            return False
+
+        self._set_result((False, CancelledError()))
+        return True
+
+    def cancelled(self):
+        result = self.result
+        return result is not None and isinstance(result[1], CancelledError)
+
+
+def _cancelled():
+    """Sent instead of the tasks cancelled while they were queued"""
+    raise CancelledError()
+
+
+def _apply_async(pool, fun, args, kwds, registry=None, metrics=None, autoscaler=None, limiter=None):
+    if limiter is not None:
+        return limiter(_apply_async, pool, fun, args, kwds, registry, metrics, autoscaler)
+
+    if _has_futures(args, kwds):
+        return _DeferredFuture(
+            lambda args, kwds: _apply_async(pool, fun, args, kwds, registry, metrics, autoscaler), args, kwds
+        )
+
+    future = _Future(pool=pool)
+
+    if metrics is not None:
+        future.record = metrics._submit(fun)
+
+    refs = None
+    if registry is not None:
+        # functions pickle cannot handle are serialized once, the files they are loaded from
+        # are kept until the task is done
+        fun, args, refs = registry.register_task(fun, args)
+
+    if registry is not None or metrics is not None:
+        fun, args, kwds = _call, (fun, args, kwds, future.record), dict()
+
+    future.future = pool.apply_async(
+        fun, args, kwds, callback=future._on_success, error_callback=future._on_error
+    )
+
+    if refs:
+        future.add_done_callback(lambda _: registry.release(refs))
+
+    if metrics is not None:
+        metrics._observe(future.record, future)
+
+    if autoscaler is not None:
+        autoscaler.track(future)
+
+    return future
+
+
+class _JobStates:
+    """State of the jobs shared by a pool and its workers.
+
+    The slot of a job, its id modulo ``JOB_SLOTS``, holds ``job + 1`` once
+    the job is cancelled and ``-(job + 1)`` once a worker started it.
+    A cancelled job whose slot is reused by a later job before it starts
+    still runs, its result is dropped.
+
+    Each worker also claims a worker slot, found from its pid, holding
+    its pid, the job it runs plus one (0 when idle) and, if ``timed``, when it started the job.
+    Workers are only killed while holding the lock, so they never die holding it.
+    """
+
+    def __init__(self, ctx, timed=False):
+        self.lock = ctx.Lock()
+        self.slots = ctx.RawArray('q', JOB_SLOTS)
+        self.workers = ctx.RawArray('d', 3 * WORKER_SLOTS)
+        self.timed = timed
+        self.index = None
+
+    def __getstate__(self):
+        return self.lock, self.slots, self.workers, self.timed
+
+    def __setstate__(self, state):
+        self.lock, self.slots, self.workers, self.timed = state
+        self.index = None
+
+    def cancel(self, job):
+        """Returns false if the job already started"""
+        i = job % JOB_SLOTS
+
+        with self.lock:
+            if self.slots[i] == -(job + 1):
+                return False
+
+            self.slots[i] = job + 1
+            return True
+
+    def start(self, job):
+        """Returns false if the job was cancelled"""
+        i = job % JOB_SLOTS
+
+        with self.lock:
+            if self.slots[i] == job + 1:
+                return False
+
+            self.slots[i] = -(job + 1)
+
+            if self.index is None:
+                self.index = self._claim(os.getpid())
+
+            if self.index is not None:
+                self.workers[3 * self.index + 1] = job + 1
+
+                # only the watchdog needs the start time
+                if self.timed:
+                    self.workers[3 * self.index + 2] = time.time()
+
+            return True
+
+    def finish(self):
+        """Mark the worker as idle, called before it sends its result"""
+        if self.index is None:
+            return
+
+        # workers are killed while the lock is held, once idle they cannot be killed while sending
+        with self.lock:
+            self.workers[3 * self.index + 1] = 0
+
+    def _claim(self, pid):
+        for k in range(WORKER_SLOTS):
+            i = (pid + k) % WORKER_SLOTS
+            owner = int(self.workers[3 * i])
+
+            if owner == 0 or owner == pid or not _alive(owner):
+                self.workers[3 * i: 3 * i + 3] = [pid, 0, 0]
+                return i
+
+        return None
+
+    def running(self):
+        """Returns the ``(slot, pid, job, start)`` of the jobs being run, the lock must be held"""
+        workers = self.workers[:]
+
+        return [
+            (i // 3, int(workers[i]), int(workers[i + 1]) - 1, workers[i + 2])
+            for i in range(0, len(workers), 3) if workers[i + 1]
+        ]
+
+
+def _alive(pid):
+    try:
+        os.kill(pid, 0)
+        return True
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+
+
+def _close_segment(shm):
+    """Close a segment if no object is using its memory anymore"""
+    try:
+        shm.close()
+        return True
+    except BufferError:
+        return False
+
+
+class _SimpleQueue(SimpleQueue):
+    """Queue that serializes its messages once with :func:`apool.utils._dumps`.
+
+    A message is a frame describing the out-of-band buffers, a frame with the pickle,
+    followed by one frame per buffer, buffers are written straight from the
+    memory of the object being sent.
+
+    With ``shared_memory`` large buffers are copied to a shared memory segment
+    instead and only its name is sent, the receiver builds the objects on top of the segment.
+    The sender owns the segments of the tasks and unlinks them once their result arrive,
+    the receiver owns the segments of the results.
+
+    With ``instrument`` the serialization time and size of each message is sent
+    in its first frame, and saved in the records of the tasks.
+    """
+
+    def __init__(self, *, ctx, shared_memory=False, unlink_on_receive=False, instrument=False, jobs=None):
+        super().__init__(ctx=ctx)
+
+        # a message is made of multiple frames, writers always need the lock
+        if self._wlock is None:
+            self._wlock = ctx.Lock()
+
+        self.shared_memory = shared_memory
+        self.unlink_on_receive = unlink_on_receive
+        self.instrument = instrument
+        self.jobs = jobs
+        self.owned = dict()
+        self.attached = []
+
+    def __getstate__(self):
+        return super().__getstate__(), self.shared_memory, self.unlink_on_receive, self.instrument, self.jobs
+
+    def __setstate__(self, state):
+        state, self.shared_memory, self.unlink_on_receive, self.instrument, self.jobs = state
+        super().__setstate__(state)
+        self.owned = dict()
+        self.attached = []
+
+    def get(self):
+        with self._rlock:
+            data, buffers, _ = self._recv_frames()
+
+        start = time.time() if self.instrument else None
+        task = _loads(data, buffers)
+
+        if self.instrument:
+            record = _task_record(task)
+
+            if record is not None:
+                record.loads_start, record.loads_end = start, time.time()
+
+        # tasks cancelled after they were sent
+        if task is not None and self.jobs is not None and not self.jobs.start(task[0]):
+            task = (task[0], task[1], _cancelled, (), dict())
+
+        return task
+
+    def put(self, obj):
+        # workers send their results with put, they are not running a job anymore
+        if self.jobs is not None:
+            self.jobs.finish()
+
+        # serialize and copy to shared memory before acquiring the lock
+        header, data, frames, _ = self._prepare(obj)
+
+        with self._wlock:
+            self._send(header, data, frames)
+
+    def _send_obj(self, obj):
+        # tasks are (job, i, func, args, kwds)
+        job = obj[0] if obj is not None else None
+        header, data, frames, stats = self._prepare(obj, job)
+
+        if stats is not None:
+            record = _task_record(obj)
+
+            if record is not None:
+                record.dumps_start, record.dumps_end, record.nbytes_in = stats
+
+        self._send(header, data, frames)
+
+    def _prepare(self, obj, job=None):
+        start = time.time() if self.instrument else None
+        data, buffers = _dumps(obj)
+        descriptors = []
+        frames = []
+
+        for buffer in buffers:
+            buffer = buffer.raw()
+
+            if self.shared_memory and buffer.nbytes >= SHARED_MEMORY_THRESHOLD:
+                descriptors.append((self._share(buffer, job), buffer.nbytes))
+            else:
+                descriptors.append(buffer.nbytes)
+                frames.append(buffer)
+
+        # (start, end, size) of the serialization
+        stats = None
+        if self.instrument:
+            nbytes = data.nbytes + sum(d if isinstance(d, int) else d[1] for d in descriptors)
+            stats = start, time.time(), nbytes
+
+        return pickle.dumps((descriptors, stats)), data, frames, stats
+
+    def _share(self, buffer, job):
+        from apool.backends.segments import _Segment
+
+        shm = _Segment(create=True, size=buffer.nbytes)
+        shm.buf[:buffer.nbytes] = buffer.cast('B')
+        shm.close()
+
+        if job is not None:
+            self.owned.setdefault(job, []).append(shm.name)
+
+        return shm.name
+
+    def _send(self, header, data, frames):
+        self._writer.send_bytes(header)
+        self._writer.send_bytes(data)
+
+        for frame in frames:
+            self._writer.send_bytes(frame)
+
+    def _recv_obj(self):
+        data, buffers, stats = self._recv_frames()
+
+        if stats is None:
+            return _loads(data, buffers)
+
+        # results are (job, i, (success, value))
+        start = time.time()
+        result = _loads(data, buffers)
+        value = result[2][1] if result is not None else None
+
+        if isinstance(value, _Result):
+            record = value.record
+            record.result_dumps_start, record.result_dumps_end, record.nbytes_out = stats
+            record.result_loads_start, record.result_loads_end = start, time.time()
+
+        return result
+
+    def _recv_frames(self):
+        descriptors, stats = pickle.loads(self._reader.recv_bytes())
+        data = self._reader.recv_bytes()
+        buffers = []
+
+        if self.attached:
+            self.attached = [shm for shm in self.attached if not _close_segment(shm)]
+
+        for descriptor in descriptors:
+            if isinstance(descriptor, tuple):
+                buffers.append(self._attach(*descriptor))
+                continue
+
+            # receive in a bytearray so the deserialized objects are writable
+            buffer = bytearray(descriptor)
+            self._reader.recv_bytes_into(buffer)
+            buffers.append(buffer)
+
+        return data, buffers, stats
+
+    def _attach(self, name, size):
+        from apool.backends.segments import _Segment
+
+        shm = _Segment(name=name)
+
+        if self.unlink_on_receive:
+            # the memory stays available until the segment is closed
+            shm.unlink()
+
+        self.attached.append(shm)
+        return shm.buf[:size]
+
+    def release(self, job):
+        """Unlink the segments used by the arguments of a job"""
+        if job not in self.owned:
+            return
+
+        from apool.backends.segments import _unlink
+
+        for name in self.owned.pop(job):
+            _unlink(name)
+
+    def release_all(self):
+        """Unlink all the segments owned by this queue and close the unused ones"""
+        for job in list(self.owned):
+            self.release(job)
+
+        self.attached = [shm for shm in self.attached if not _close_segment(shm)]
+
+
+class _Vacancy:
+    """Exited worker added to a pool so its worker handler starts the missing workers"""
+
+    pid = None
+    exitcode = 0
+
+    def join(self, timeout=None):
+        pass
+
+    def is_alive(self):
+        return False
+
+    def terminate(self):
+        pass
+
+
+class _Size:
+    """Number of workers of a pool, the worker handler thread receives
+    the number of workers once so it is shared through this mutable object
+    """
+
+    def __init__(self, value):
+        self.value = value
+
+    def __sub__(self, other):
+        return self.value - other
+
+    def __lt__(self, other):
+        return self.value < other
+
+    def __repr__(self):
+        return repr(self.value)
 
 
 class _Pool(PyPool):
-    """Custom pool that does not set its worker as daemon process"""
+    """Custom pool that does not set its worker as daemon process
+    and serializes tasks and results only once
+
+    Parameters
+    ----------
+    shared_memory: bool
+        send buffers larger than ``SHARED_MEMORY_THRESHOLD`` through shared memory
+
+    instrument: bool
+        measure the serialization time and size of the tasks and results
+
+    warmup: bool
+        block until every worker has run its initializer
+
+    resizable: bool
+        allow the number of workers to change with :meth:`resize`
+
+    context: str or multiprocessing context
+        start method of the workers, ``fork``, ``spawn`` or ``forkserver``
+
+    preload: list of str
+        modules imported before the workers start running tasks, see :func:`_get_context`
+
+    task_timeout: float
+        kill the workers running a job for longer (s), the job fails with :class:`TimeoutError`
+        and the pool replaces the worker
+    """
 
     ALLOW_DAEMON = True
 
-    @staticmethod
-    def Process(*args, **kwds):
-        import sys
+    def __init__(self, processes=None, initializer=None, initargs=(), maxtasksperchild=None, context=None, *,
+                 shared_memory=False, instrument=False, warmup=False, resizable=False, preload=(),
+                 task_timeout=None):
+        self.shared_memory = shared_memory
+        self.instrument = instrument
+        context, preload = _get_context(context, preload)
+
+        self._jobs = _JobStates(context, timed=task_timeout is not None)
+
+        if shared_memory:
+            # workers need to share our tracker so segments they create
+            # can be unlinked by us without being reported as leaked
+            from multiprocessing import resource_tracker
+
+            resource_tracker.ensure_running()
+
+        ready = None
+        if warmup:
+            ready = context.Semaphore(0)
+
+        if initializer is not None or warmup or preload:
+            initializer, initargs = _initialize, (initializer, initargs, ready, preload)
+
+        if resizable:
+            processes = _Size(processes or os.cpu_count() or 1)
+
+        super().__init__(processes, initializer, initargs, maxtasksperchild, context)
+
+        if warmup:
+            for _ in range(len(self._pool)):
+                ready.acquire()
+
+        self._watchdog = None
+        if task_timeout is not None:
+            self._watchdog = Thread(target=self._watch, args=(task_timeout,), name='apool-watchdog', daemon=True)
+            self._watchdog.start()
+
+    def _watch(self, timeout):
+        interval = min(timeout / 4, 0.5)
+
+        # running jobs are watched until the pool is joined or terminated
+        while self._state == RUN or (self._state == CLOSE and self._cache):
+            time.sleep(interval)
+            now = time.time()
+
+            with self._jobs.lock:
+                expired = [job for _, _, job, start in self._jobs.running() if now - start > timeout]
+
+            for job in expired:
+                self._kill(job, TimeoutError(f'the task exceeded its {timeout}s timeout, its worker was killed'))
+
+    def _kill(self, job, exception):
+        """Kill the worker running ``job`` and fail the job with ``exception``, returns false if it is not running"""
+        with self._jobs.lock:
+            pid = None
+            for slot, worker, running, _ in self._jobs.running():
+                if running == job and job in self._cache:
+                    pid = worker
+                    self._jobs.workers[3 * slot + 1] = 0
+                    break
+
+            if pid is None:
+                return False
+
+            for process in list(self._pool):
+                if process.pid == pid:
+                    process.kill()
+
+        # the job is resolved by the result handler like any other job
+        self._outqueue.put((job, 0, (False, exception)))
+        return True
+
+    def _cancel(self, job):
+        """Prevent a job from starting, returns false if a worker already started it"""
+        return self._jobs.cancel(job)
+
+    def cancel_pending(self):
+        """Cancel all the jobs that did not start yet, their futures raise CancelledError"""
+        for job in list(self._cache):
+            self._jobs.cancel(job)
+
+    def resize(self, processes):
+        """Change the number of workers, extra workers exit once they are idle"""
+        previous, self._processes.value = self._processes.value, processes
+
+        # the worker handler is the only thread starting workers, it only does so after one exited
+        if processes > previous:
+            self._pool.append(_Vacancy())
+            self._change_notifier.put(None)
 
-        v = sys.version_info
+        # the task handler is the only writer of the inqueue
+        for _ in range(previous - processes):
+            self._taskqueue.put(([None], None))
 
-        #  < 3.8 use self._ctx
-        # >= 3.8 ctx as an argument
-        if v.major == 3 and v.minor >= 8:
-            args = args[1:]
+    def _setup_queues(self):
+        self._inqueue = _SimpleQueue(
+            ctx=self._ctx, shared_memory=self.shared_memory, instrument=self.instrument, jobs=self._jobs
+        )
+        self._outqueue = _SimpleQueue(
+            ctx=self._ctx, shared_memory=self.shared_memory, unlink_on_receive=True, instrument=self.instrument,
+            jobs=self._jobs,
+        )
+        self._quick_put = self._inqueue._send_obj
 
+        inqueue, outqueue = self._inqueue, self._outqueue
+
+        def get():
+            result = outqueue._recv_obj()
+
+            # the arguments are not needed once the result is back
+            if result is not None and inqueue.owned:
+                inqueue.release(result[0])
+
+            return result
+
+        self._quick_get = get
+
+    def terminate(self):
+        super().terminate()
+        self._inqueue.release_all()
+        self._outqueue.release_all()
+
+    @staticmethod
+    def _help_stuff_finish(inqueue, task_handler, size):
+        # task_handler may be blocked trying to put items on inqueue,
+        # drop the raw frames since they are not all pickles
+        inqueue._rlock.acquire()
+        while task_handler.is_alive() and inqueue._reader.poll():
+            inqueue._reader.recv_bytes()
+            time.sleep(0)
+
+    @staticmethod
+    def Process(ctx, *args, **kwds):
         if _Pool.ALLOW_DAEMON:
-            return Process(*args, **kwds)
+            return ctx.Process(*args, **kwds)
 
-        return _Process(*args, **kwds)
+        return _NON_DAEMONIC[ctx.Process](*args, **kwds)
+
+
+def _make_pool(n_workers, autoscale, *args, **kwargs):
+    """Returns the pool and its autoscaler"""
+    if autoscale is None:
+        return _Pool(n_workers, *args, **kwargs), None
+
+    n_workers = autoscale.initial_workers(n_workers)
+    pool = _Pool(n_workers, *args, resizable=True, **kwargs)
+    return pool, _Autoscaler(autoscale, pool.resize, n_workers)
 
 
 class ProcessExecutor(Executor):
+    """Executor running the tasks in worker processes
+
+    Parameters
+    ----------
+    n_workers: int
+        number of worker processes, defaults to the number of cpus
+
+    shared_memory: bool
+        send large buffers (numpy arrays, ...) through shared memory instead of pipes
+
+    metrics: bool or Metrics
+        collect metrics about the tasks, see :class:`apool.metrics.Metrics`
+
+    initializer: callable
+        called with ``initargs`` when a worker starts, see :func:`apool.worker_state`
+
+    initargs: tuple
+        arguments of the initializer
+
+    maxtasksperchild: int
+        number of tasks a worker executes before being replaced by a new one
+
+    warmup: bool
+        block until every worker has run its initializer
+
+    autoscale: Autoscale
+        resize the pool with its load, ``n_workers`` is the initial number of workers,
+        see :class:`apool.autoscale.Autoscale`
+
+    max_pending: int
+        maximum number of tasks submitted and not finished yet, submitting more blocks
+
+    submit_timeout: float
+        time to wait for a task to finish when ``max_pending`` are pending,
+        0 raises :class:`queue.Full` right away and None waits forever
+
+    context: str or multiprocessing context
+        start method of the workers, ``'fork'``, ``'spawn'`` or ``'forkserver'``,
+        defaults to the platform default
+
+    preload: list of str
+        modules to import before running tasks. With ``forkserver`` the server imports them once
+        and every worker inherits them, with ``fork`` they are imported by this process
+        and with ``spawn`` by each worker when it starts. Modules added once the fork server
+        is running are imported by each worker
+
+    task_timeout: float
+        maximum time a task can run (s), the worker running a task for longer is killed
+        and replaced, the task fails with :class:`multiprocessing.TimeoutError`
+    """
+
     CLOUDPICKLE = True
 
-    def __init__(self, n_workers):
-        self.pool = _Pool(n_workers)
+    def __init__(self, n_workers, shared_memory=False, metrics=None, initializer=None, initargs=(),
+                 maxtasksperchild=None, warmup=False, autoscale=None,
+                 max_pending=None, submit_timeout=None, context=None, preload=(), task_timeout=None):
+        self.metrics = _make_metrics(metrics)
+        self.limiter = _make_limiter(max_pending, submit_timeout)
+        self.pool, self.autoscaler = _make_pool(
+            n_workers, autoscale, initializer, initargs, maxtasksperchild, context,
+            shared_memory=shared_memory, instrument=self.metrics is not None, warmup=warmup, preload=preload,
+            task_timeout=task_timeout,
+        )
+        self.registry = _FunctionRegistry() if self.CLOUDPICKLE else None
+        self.broadcasts = None
 
     def submit(self, fn, *args, **kwargs):
         """
@@ -112,21 +861,189 @@ class ProcessExecutor(Executor):
         10
         
         """
-        if ProcessPool.CLOUDPICKLE:
-            f = self.pool.apply_async(_cloudpickle, [_payload(fn, args, kwargs)])
-            return _Future(f, True)
-        
-        return _Future(self.pool.apply_async(fn, args, kwds=kwargs))
+        return _apply_async(self.pool, fn, args, kwargs, self.registry, self.metrics, self.autoscaler, self.limiter)
+
+    def broadcast(self, obj):
+        """Returns a handle to pass to the tasks instead of ``obj``, ``obj`` is pickled once
+        in a temporary directory, each worker loads it the first time it receives the handle
+        and keeps it for the next tasks.
+        """
+        if self.broadcasts is None:
+            self.broadcasts = _Store('broadcast')
+
+        return self.broadcasts.put(_pickle(obj))
+
+    def register(self, fn):
+        """Serialize ``fn`` again, the tasks submitted after see the current state of a closure"""
+        if self.registry is not None:
+            self.registry.register(fn, refresh=True)
 
     def shutdown(self, wait=True, *, cancel_futures=False):
-        return self.pool.terminate()
+        """Stop accepting tasks and release the workers once the pending tasks are done
+
+        Parameters
+        ----------
+        wait: bool
+            block until the pending tasks are done, else they finish in the background
+
+        cancel_futures: bool
+            cancel the tasks that were not sent to a worker yet
+
+        Examples
+        --------
+
+        >>> from apool import Executor, Process
+        >>> from apool.testing import slow_inc
+
+        >>> p = Executor(Process, 1)
+        >>> futures = [p.submit(slow_inc, i, 0.1) for i in range(4)]
+        >>> p.shutdown(cancel_futures=True)
+        >>> sum(f.cancelled() for f in futures) >= 2
+        True
+
+        """
+        if self.pool._state != RUN:
+            return
+
+        if self.autoscaler is not None:
+            self.autoscaler.close()
+
+        if cancel_futures:
+            self.pool.cancel_pending()
+
+        self.pool.close()
+
+        if wait:
+            self._finalize()
+        else:
+            Thread(target=self._finalize, name='apool-shutdown', daemon=True).start()
+
+    def _finalize(self):
+        self.pool.join()
+        self.pool.terminate()
+
+        if self.registry is not None:
+            self.registry.close()
+
+        if self.broadcasts is not None:
+            self.broadcasts.close()
 
 
 class ProcessPool(Pool):
+    """Pool running the tasks in worker processes
+
+    Parameters
+    ----------
+    n_workers: int
+        number of worker processes, defaults to the number of cpus
+
+    shared_memory: bool
+        send large buffers (numpy arrays, ...) through shared memory instead of pipes.
+        The arguments segments are released once the result is received,
+        the results segments once the result object is not used anymore.
+
+    metrics: bool or Metrics
+        collect metrics about the tasks, see :class:`apool.metrics.Metrics`
+
+    initializer: callable
+        called with ``initargs`` when a worker starts, see :func:`apool.worker_state`
+
+    initargs: tuple
+        arguments of the initializer
+
+    maxtasksperchild: int
+        number of tasks a worker executes before being replaced by a new one
+
+    warmup: bool
+        block until every worker has run its initializer
+
+    autoscale: Autoscale
+        resize the pool with its load, ``n_workers`` is the initial number of workers,
+        see :class:`apool.autoscale.Autoscale`
+
+    max_pending: int
+        maximum number of tasks submitted and not finished yet, submitting more blocks
+
+    submit_timeout: float
+        time to wait for a task to finish when ``max_pending`` are pending,
+        0 raises :class:`queue.Full` right away and None waits forever
+
+    context: str or multiprocessing context
+        start method of the workers, ``'fork'``, ``'spawn'`` or ``'forkserver'``,
+        defaults to the platform default
+
+    preload: list of str
+        modules to import before running tasks. With ``forkserver`` the server imports them once
+        and every worker inherits them, with ``fork`` they are imported by this process
+        and with ``spawn`` by each worker when it starts. Modules added once the fork server
+        is running are imported by each worker
+
+    task_timeout: float
+        maximum time a task can run (s), the worker running a task for longer is killed
+        and replaced, the task fails with :class:`multiprocessing.TimeoutError`
+
+    Examples
+    --------
+
+    Tasks running longer than ``task_timeout`` fail, their worker is replaced
+
+    >>> from apool import Pool, Process
+    >>> from apool.testing import inc, slow_inc
+
+    >>> with Pool(Process, 1, task_timeout=0.5) as p:
+    ...     p.apply(slow_inc, (1, 60))
+    Traceback (most recent call last):
+      ...
+    multiprocessing.context.TimeoutError: the task exceeded its 0.5s timeout, its worker was killed
+
+    >>> with Pool(Process, 1, task_timeout=0.5) as p:
+    ...     future = p.apply_async(slow_inc, (1, 60))
+    ...     future.wait()
+    ...     future.successful(), p.apply(inc, (1,))
+    (False, 2)
+
+    Running tasks are interrupted by killing their worker
+
+    >>> with Pool(Process, 1) as p:
+    ...     future = p.apply_async(slow_inc, (1, 60))
+    ...     future.cancel(interrupt=True), future.cancelled(), p.apply(inc, (2,))
+    (True, True, 3)
+
+    Pools started with ``forkserver`` share the same server
+
+    >>> from apool import Pool, Process
+    >>> from apool.testing import imported, inc
+
+    >>> with Pool(Process, 2, context='forkserver') as a:
+    ...     with Pool(Process, 2, context='forkserver', preload=['json']) as b:
+    ...         a.apply(inc, (1,)), b.apply(imported, ('json',))
+    (2, True)
+
+    >>> from pickle import PickleBuffer
+    >>> from apool import Pool, Process
+
+    >>> with Pool(Process, 2, shared_memory=True) as p:
+    ...     p.apply(len, (PickleBuffer(bytearray(SHARED_MEMORY_THRESHOLD)),))
+    1048576
+
+    """
+
     CLOUDPICKLE = True
     
-    def __init__(self, n_workers):
-        self.pool = _Pool(n_workers)
+    def __init__(self, n_workers, shared_memory=False, metrics=None, initializer=None, initargs=(),
+                 maxtasksperchild=None, warmup=False, autoscale=None,
+                 max_pending=None, submit_timeout=None, context=None, preload=(), task_timeout=None):
+        self.metrics = _make_metrics(metrics)
+        self.limiter = _make_limiter(max_pending, submit_timeout)
+        self.pool, self.autoscaler = _make_pool(
+            n_workers, autoscale, initializer, initargs, maxtasksperchild, context,
+            shared_memory=shared_memory, instrument=self.metrics is not None, warmup=warmup, preload=preload,
+            task_timeout=task_timeout,
+        )
+        # None starts one worker per cpu, with autoscaling chunks are sized for the largest pool
+        self.n_workers = len(self.pool._pool) if autoscale is None else autoscale.max_workers
+        self.registry = _FunctionRegistry() if self.CLOUDPICKLE else None
+        self.broadcasts = None
 
     def apply_async(self, fun, args, kwds=None) -> Future:
         """
@@ -146,17 +1063,78 @@ class ProcessPool(Pool):
         if kwds is None:
             kwds = dict()
 
-        if ProcessPool.CLOUDPICKLE:
-            f = self.pool.apply_async(_cloudpickle, [_payload(fun, args, kwds)])
-            return _Future(f, True)
+        return _apply_async(self.pool, fun, args, kwds, self.registry, self.metrics, self.autoscaler, self.limiter)
+
+    def broadcast(self, obj):
+        """Returns a handle to pass to the tasks instead of ``obj``, ``obj`` is pickled once
+        in a temporary directory, each worker loads it the first time it receives the handle
+        and keeps it for the next tasks.
 
-        return _Future(self.pool.apply_async(fun, args, kwds))
+        Examples
+        --------
+
+        >>> from apool import Pool, Process
+        >>> from apool.testing import add
+
+        >>> with Pool(Process, 2) as p:
+        ...     table = p.broadcast(10)
+        ...     p.starmap(add, [(1, table), (2, table)])
+        [11, 12]
+
+        """
+        if self.broadcasts is None:
+            self.broadcasts = _Store('broadcast')
+
+        return self.broadcasts.put(_pickle(obj))
+
+    def register(self, fun):
+        """Serialize ``fun`` again, the tasks submitted after see the current state of a closure.
+        Functions pickle cannot handle are serialized the first time they are submitted and then
+        looked up by identity.
+
+        Examples
+        --------
+
+        >>> from apool import Pool, Process
+
+        >>> state = dict(w=1)
+        >>> scale = lambda x: x * state['w']
+
+        >>> with Pool(Process, 2) as p:
+        ...     a = p.apply(scale, (10,))
+        ...     state['w'] = 5
+        ...     b = p.apply(scale, (10,))
+        ...     p.register(scale)
+        ...     a, b, p.apply(scale, (10,))
+        (10, 10, 50)
+
+        """
+        if self.registry is not None:
+            self.registry.register(fun, refresh=True)
 
     def close(self):
+        if self.autoscaler is not None:
+            self.autoscaler.close()
+
         self.pool.close()
 
     def terminate(self):
+        if self.autoscaler is not None:
+            self.autoscaler.close()
+
         self.pool.terminate()
 
+        if self.registry is not None:
+            self.registry.close()
+
+        if self.broadcasts is not None:
+            self.broadcasts.close()
+
     def join(self):
         self.pool.join()
+
+        if self.registry is not None:
+            self.registry.close()
+
+        if self.broadcasts is not None:
+            self.broadcasts.close()
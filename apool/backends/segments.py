@@ -0,0 +1,27 @@
+"""Shared memory segments of the process backend, only imported when shared memory is enabled"""
+from multiprocessing.shared_memory import SharedMemory
+import os
+
+
+class _Segment(SharedMemory):
+    """Segment whose memory can outlive it, the objects built on top of it keep the mapping
+    alive and it is unmapped once the last of them is released"""
+
+    def __del__(self):
+        try:
+            self.close()
+        except BufferError:
+            # the views keep the mapping, only the file descriptor is released
+            if getattr(self, '_fd', -1) >= 0:
+                os.close(self._fd)
+                self._fd = -1
+
+
+def _unlink(name):
+    try:
+        shm = _Segment(name=name)
+    except FileNotFoundError:
+        return
+
+    shm.close()
+    shm.unlink()
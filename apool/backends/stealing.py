@@ -0,0 +1,383 @@
+from collections import deque
+from concurrent.futures import Future as ConcurrentFuture
+from concurrent.futures import TimeoutError
+from itertools import count
+from threading import Event, Semaphore, Thread, local
+import os
+import time
+
+from apool.backends.thread import _Task, _ThreadFuture
+from apool.graph import _DeferredFuture, _has_futures
+from apool.interfaces import Future, Pool, Executor
+from apool.metrics import _make_metrics, _run
+from apool.utils import _make_limiter
+from apool.worker import _initialize
+
+
+class _Scheduler:
+    """Work stealing scheduler, each worker thread owns a deque of tasks.
+
+    Workers pop their own tasks from the back (most recent first) and steal
+    from the front of the others' deques when they run out of work.
+    Tasks submitted from a worker go to its own deque, tasks submitted from
+    outside are spread round robin. ``deque`` append and pop are atomic
+    so no lock is shared between submitters.
+
+    Idle workers park on their own event, submitters wake one parked worker.
+    A worker waiting on a future keeps running tasks until the future is done,
+    so tasks can submit subtasks and wait on them without deadlocking.
+    """
+
+    def __init__(self, n_workers, initializer=None, initargs=(), warmup=False):
+        if n_workers is None:
+            n_workers = os.cpu_count() or 1
+
+        self.initializer = initializer
+        self.initargs = initargs
+        self.ready = Semaphore(0)
+        self.errors = []
+        self.deques = [deque() for _ in range(n_workers)]
+        self.events = [Event() for _ in range(n_workers)]
+        self.parked = deque()
+        self.counter = count()
+        self.local = local()
+        self.running = True
+        self.threads = [
+            Thread(target=self._worker, args=(i,), name=f'apool-stealing-{i}', daemon=True)
+            for i in range(n_workers)
+        ]
+
+        for thread in self.threads:
+            thread.start()
+
+        if warmup:
+            for _ in self.threads:
+                self.ready.acquire()
+
+            if self.errors:
+                self.shutdown()
+                raise self.errors[0]
+
+    def submit(self, fn, args, kwargs):
+        index = getattr(self.local, 'index', None)
+
+        # running tasks can still submit subtasks
+        if not self.running and index is None:
+            raise RuntimeError('cannot schedule new futures after shutdown')
+
+        future = ConcurrentFuture()
+
+        if index is None:
+            index = next(self.counter) % len(self.deques)
+
+        self.deques[index].append(_Task(future, fn, args, kwargs))
+        self._wake()
+        return future
+
+    def _wake(self):
+        try:
+            self.parked.popleft().set()
+        except IndexError:
+            pass
+
+    def _find(self, index):
+        try:
+            return self.deques[index].pop()
+        except IndexError:
+            pass
+
+        n = len(self.deques)
+        for i in range(1, n):
+            try:
+                return self.deques[(index + i) % n].popleft()
+            except IndexError:
+                pass
+
+        return None
+
+    def _park(self, index, done, timeout=None):
+        """Wait until new work is submitted, returns a task if some was found while parking.
+
+        ``done`` returns true once the worker must not wait anymore, it is checked after
+        clearing the event so a wake up sent in between is not lost.
+        """
+        event = self.events[index]
+        event.clear()
+        self.parked.append(event)
+
+        # a task might have been submitted before we got parked
+        task = self._find(index)
+        if task is None and not done():
+            event.wait(timeout)
+
+        # a stale event would swallow the wake up of another parked worker
+        try:
+            self.parked.remove(event)
+        except ValueError:
+            # popped by the submitter that woke us up
+            pass
+
+        return task
+
+    def _worker(self, index):
+        self.local.index = index
+
+        try:
+            _initialize(self.initializer, self.initargs)
+        except BaseException as exc:
+            # the other workers steal the tasks of this one
+            self.errors.append(exc)
+            raise
+        finally:
+            self.ready.release()
+
+        while True:
+            task = self._find(index)
+
+            if task is None and self.running:
+                task = self._park(index, self._stopped)
+
+            if task is not None:
+                task.run()
+            elif not self.running:
+                return
+
+    def _stopped(self):
+        return not self.running
+
+    def help(self, future, timeout=None):
+        """Run tasks until ``future`` is done if called from a worker"""
+        index = getattr(self.local, 'index', None)
+
+        if index is None or future.done():
+            return
+
+        deadline = None if timeout is None else time.monotonic() + timeout
+        event = self.events[index]
+        future.add_done_callback(lambda _: event.set())
+
+        while not future.done():
+            task = self._find(index)
+
+            if task is None:
+                remaining = None
+                if deadline is not None:
+                    remaining = deadline - time.monotonic()
+
+                    if remaining <= 0:
+                        raise TimeoutError()
+
+                task = self._park(index, future.done, remaining)
+
+            if task is not None:
+                task.run()
+
+    def submit_future(self, fn, args, kwargs, metrics=None, limiter=None):
+        # subtasks are not limited, their parent waiting on them would deadlock
+        if limiter is not None and getattr(self.local, 'index', None) is None:
+            return limiter(self.submit_future, fn, args, kwargs, metrics)
+
+        if _has_futures(args, kwargs):
+            return _DeferredFuture(lambda args, kwargs: self.submit_future(fn, args, kwargs, metrics), args, kwargs)
+
+        if metrics is None:
+            return _StealingFuture(self.submit(fn, args, kwargs), self)
+
+        record = metrics._submit(fn)
+        future = _StealingFuture(self.submit(_run, (record, fn, args, kwargs), dict()), self)
+        return metrics._observe(record, future)
+
+    def shutdown(self, wait=True, cancel=False):
+        self.running = False
+
+        if cancel:
+            for tasks in self.deques:
+                while tasks:
+                    try:
+                        tasks.popleft().future.cancel()
+                    except IndexError:
+                        break
+
+        for event in self.events:
+            event.set()
+
+        if wait:
+            for thread in self.threads:
+                if thread.is_alive():
+                    thread.join()
+
+
+class _StealingFuture(_ThreadFuture):
+    """Concurrent Future that lets the worker waiting on it run other tasks"""
+
+    __slots__ = ('scheduler',)
+
+    def __init__(self, future, scheduler):
+        super().__init__(future)
+        self.scheduler = scheduler
+
+    def get(self, timeout=None):
+        self.scheduler.help(self.future, timeout)
+        return self.future.result(timeout)
+
+    def wait(self, timeout=None):
+        try:
+            self.scheduler.help(self.future, timeout)
+        except TimeoutError:
+            return
+
+        super().wait(timeout)
+
+
+class WorkStealingExecutor(Executor):
+    """Executor with per worker task deques and work stealing,
+    suited for many fine grained and recursive tasks
+
+    Parameters
+    ----------
+    n_workers: int
+        number of threads, defaults to the number of cpus
+
+    metrics: bool or Metrics
+        collect metrics about the tasks, see :class:`apool.metrics.Metrics`
+
+    initializer: callable
+        called with ``initargs`` when a thread starts, see :func:`apool.worker_state`
+
+    initargs: tuple
+        arguments of the initializer
+
+    warmup: bool
+        block until all the threads have run their initializer
+
+    max_pending: int
+        maximum number of tasks submitted and not finished yet, submitting more blocks.
+        Tasks submitted from the workers are not limited
+
+    submit_timeout: float
+        time to wait for a task to finish when ``max_pending`` are pending,
+        0 raises :class:`queue.Full` right away and None waits forever
+
+    Examples
+    --------
+
+    >>> from apool import Executor, WorkStealing
+
+    >>> with Executor(WorkStealing, 2) as p:
+    ...     def fib(n):
+    ...         if n < 2:
+    ...             return n
+    ...         a = p.submit(fib, n - 1)
+    ...         return fib(n - 2) + a.get()
+    ...     p.submit(fib, 12).get()
+    144
+
+    """
+
+    def __init__(self, n_workers, metrics=None, initializer=None, initargs=(), warmup=False,
+                 max_pending=None, submit_timeout=None):
+        self.scheduler = _Scheduler(n_workers, initializer, initargs, warmup)
+        self.metrics = _make_metrics(metrics)
+        self.limiter = _make_limiter(max_pending, submit_timeout)
+
+    def submit(self, fn, *args, **kwargs):
+        """
+
+        Examples
+        --------
+
+        >>> from apool import Executor, WorkStealing
+        >>> from apool.testing import fun
+
+        >>> with Executor(WorkStealing, 5) as p:
+        ...     future = p.submit(fun, 1, 2, c=3, d=4)
+        ...     future.get()
+        10
+
+        """
+        return self.scheduler.submit_future(fn, args, kwargs, self.metrics, self.limiter)
+
+    def shutdown(self, wait=True, *, cancel_futures=False):
+        return self.scheduler.shutdown(wait, cancel_futures)
+
+
+class WorkStealingPool(Pool):
+    """Pool with per worker task deques and work stealing,
+    suited for many fine grained and recursive tasks
+
+    Parameters
+    ----------
+    n_workers: int
+        number of threads, defaults to the number of cpus
+
+    metrics: bool or Metrics
+        collect metrics about the tasks, see :class:`apool.metrics.Metrics`
+
+    initializer: callable
+        called with ``initargs`` when a thread starts, see :func:`apool.worker_state`
+
+    initargs: tuple
+        arguments of the initializer
+
+    warmup: bool
+        block until all the threads have run their initializer
+
+    max_pending: int
+        maximum number of tasks submitted and not finished yet, submitting more blocks.
+        Tasks submitted from the workers are not limited
+
+    submit_timeout: float
+        time to wait for a task to finish when ``max_pending`` are pending,
+        0 raises :class:`queue.Full` right away and None waits forever
+
+    Examples
+    --------
+
+    >>> from apool import Pool, WorkStealing
+
+    >>> with Pool(WorkStealing, 2) as p:
+    ...     def fib(n):
+    ...         if n < 2:
+    ...             return n
+    ...         a = p.apply_async(fib, (n - 1,))
+    ...         return fib(n - 2) + a.get()
+    ...     p.apply(fib, (12,))
+    144
+
+    """
+
+    def __init__(self, n_workers, metrics=None, initializer=None, initargs=(), warmup=False,
+                 max_pending=None, submit_timeout=None):
+        self.scheduler = _Scheduler(n_workers, initializer, initargs, warmup)
+        self.n_workers = len(self.scheduler.threads)
+        self.metrics = _make_metrics(metrics)
+        self.limiter = _make_limiter(max_pending, submit_timeout)
+
+    def apply_async(self, fun, args, kwds=None) -> Future:
+        """
+
+        Examples
+        --------
+
+        >>> from apool import Pool, WorkStealing
+        >>> from apool.testing import fun
+
+        >>> with Pool(WorkStealing, 5) as p:
+        ...     future = p.apply_async(fun, (1, 2), dict(c=3, d=4))
+        ...     future.get()
+        10
+
+        """
+        if kwds is None:
+            kwds = dict()
+
+        return self.scheduler.submit_future(fun, args, kwds, self.metrics, self.limiter)
+
+    def close(self):
+        self.scheduler.shutdown(wait=False)
+
+    def terminate(self):
+        self.scheduler.shutdown(cancel=True)
+
+    def join(self):
+        self.scheduler.shutdown()
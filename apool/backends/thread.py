@@ -1,6 +1,36 @@
+from concurrent.futures import Future as ConcurrentFuture
 from concurrent.futures import ThreadPoolExecutor, TimeoutError, wait
+from concurrent.futures.thread import BrokenThreadPool
+from queue import Empty, SimpleQueue
+from threading import Barrier, Lock, Thread
+import sys
 
+from apool.autoscale import _Autoscaler
+from apool.graph import _DeferredFuture, _has_futures
 from apool.interfaces import Future, Pool, Executor
+from apool.metrics import _make_metrics, _run
+from apool.utils import _make_limiter
+
+
+class _Task:
+    __slots__ = ('future', 'fn', 'args', 'kwargs')
+
+    def __init__(self, future, fn, args, kwargs):
+        self.future = future
+        self.fn = fn
+        self.args = args
+        self.kwargs = kwargs
+
+    def run(self):
+        if not self.future.set_running_or_notify_cancel():
+            return
+
+        try:
+            result = self.fn(*self.args, **self.kwargs)
+        except BaseException as exc:
+            self.future.set_exception(exc)
+        else:
+            self.future.set_result(result)
 
 
 class _ThreadFuture(Future):
@@ -35,6 +65,8 @@ class _ThreadFuture(Future):
 
     """
 
+    __slots__ = ('future',)
+
     def __init__(self, future):
         self.future = future
 
@@ -51,13 +83,222 @@ class _ThreadFuture(Future):
         if not self.future.done():
             raise ValueError()
 
-        return self.future.exception() is None
+        return not self.future.cancelled() and self.future.exception() is None
+
+    def add_done_callback(self, fn):
+        self.future.add_done_callback(lambda _: fn(self))
+
+    def cancel(self, interrupt=False):
+        # running threads cannot be interrupted
+        return self.future.cancel()
+
+    def cancelled(self):
+        return self.future.cancelled()
+
+
+class _ElasticExecutor:
+    """Thread executor that can be resized, threads exit when they receive ``None``"""
+
+    def __init__(self, n_workers, initializer=None, initargs=()):
+        self.initializer = initializer
+        self.initargs = initargs
+        self.queue = SimpleQueue()
+        self.lock = Lock()
+        self.threads = []
+        self.size = 0
+        self.counter = 0
+        self.broken = None
+        self.closed = False
+        self.resize(n_workers)
+
+    def submit(self, fn, *args, **kwargs):
+        with self.lock:
+            if self.broken is not None:
+                raise self.broken
+
+            if self.closed:
+                raise RuntimeError('cannot schedule new futures after shutdown')
+
+            future = ConcurrentFuture()
+            self.queue.put(_Task(future, fn, args, kwargs))
+
+        return future
+
+    def resize(self, n_workers):
+        with self.lock:
+            if self.closed:
+                return
+
+            for _ in range(n_workers - self.size):
+                thread = Thread(target=self._worker, name=f'apool-elastic-{self.counter}', daemon=True)
+                self.counter += 1
+                self.threads.append(thread)
+                thread.start()
+
+            for _ in range(self.size - n_workers):
+                self.queue.put(None)
+
+            self.size = n_workers
+            self.threads = [t for t in self.threads if t.is_alive() or not t.ident]
+
+    def _worker(self):
+        if self.initializer is not None:
+            try:
+                self.initializer(*self.initargs)
+            except BaseException:
+                self._fail()
+                raise
+
+        while True:
+            task = self.queue.get()
+
+            if task is None:
+                return
+
+            task.run()
+
+    def _fail(self):
+        with self.lock:
+            self.broken = BrokenThreadPool('A thread initializer failed, the thread pool is not usable anymore')
+
+        self._drain(self.broken)
+
+    def _drain(self, exception=None):
+        while True:
+            try:
+                task = self.queue.get_nowait()
+            except Empty:
+                return
+
+            if task is None:
+                continue
+
+            if exception is None:
+                task.future.cancel()
+            elif task.future.set_running_or_notify_cancel():
+                task.future.set_exception(exception)
+
+    def shutdown(self, wait=True, cancel_futures=False):
+        with self.lock:
+            self.closed = True
+            threads = list(self.threads)
+
+        if cancel_futures:
+            self._drain()
+
+        for _ in threads:
+            self.queue.put(None)
+
+        if wait:
+            for thread in threads:
+                thread.join()
+
+
+def _executor(n_workers, initializer=None, initargs=(), warmup=False, elastic=False):
+    if elastic:
+        executor = _ElasticExecutor(n_workers, initializer, initargs)
+    else:
+        executor = ThreadPoolExecutor(n_workers, initializer=initializer, initargs=initargs)
+        n_workers = executor._max_workers
+
+    if warmup:
+        # threads are started on submit while none is idle, the tasks
+        # wait on each other so each of them starts its own thread
+        barrier = Barrier(n_workers)
+        futures = [executor.submit(barrier.wait) for _ in range(n_workers)]
+
+        try:
+            for future in futures:
+                future.result()
+        except BaseException:
+            barrier.abort()
+            raise
+
+    return executor
+
+
+def _shutdown(executor, wait=True, cancel_futures=False):
+    # cancel_futures is only accepted by ThreadPoolExecutor.shutdown since python 3.9
+    if sys.version_info >= (3, 9) or isinstance(executor, _ElasticExecutor):
+        return executor.shutdown(wait=wait, cancel_futures=cancel_futures)
+
+    if cancel_futures:
+        while True:
+            try:
+                item = executor._work_queue.get_nowait()
+            except Empty:
+                break
+
+            if item is not None:
+                item.future.cancel()
+
+    executor.shutdown(wait=wait)
+
+
+def _submit(executor, metrics, fun, args, kwds, autoscaler=None, limiter=None):
+    if limiter is not None:
+        return limiter(_submit, executor, metrics, fun, args, kwds, autoscaler)
+
+    if _has_futures(args, kwds):
+        return _DeferredFuture(lambda args, kwds: _submit(executor, metrics, fun, args, kwds, autoscaler), args, kwds)
+
+    if metrics is None:
+        future = _ThreadFuture(executor.submit(fun, *args, **kwds))
+    else:
+        record = metrics._submit(fun)
+        future = metrics._observe(record, _ThreadFuture(executor.submit(_run, record, fun, args, kwds)))
+
+    if autoscaler is not None:
+        autoscaler.track(future)
+
+    return future
 
 
 class ThreadExecutor(Executor):
-    
-    def __init__(self, n_workers):
-        self.exec = ThreadPoolExecutor(n_workers)
+    """Executor running the tasks in threads
+
+    Parameters
+    ----------
+    n_workers: int
+        number of threads, defaults to the default of :class:`concurrent.futures.ThreadPoolExecutor`
+
+    metrics: bool or Metrics
+        collect metrics about the tasks, see :class:`apool.metrics.Metrics`
+
+    initializer: callable
+        called with ``initargs`` when a thread starts, see :func:`apool.worker_state`
+
+    initargs: tuple
+        arguments of the initializer
+
+    warmup: bool
+        start all the threads and block until they have run their initializer
+
+    autoscale: Autoscale
+        resize the pool with its load, ``n_workers`` is the initial number of threads,
+        see :class:`apool.autoscale.Autoscale`
+
+    max_pending: int
+        maximum number of tasks submitted and not finished yet, submitting more blocks
+
+    submit_timeout: float
+        time to wait for a task to finish when ``max_pending`` are pending,
+        0 raises :class:`queue.Full` right away and None waits forever
+    """
+
+    def __init__(self, n_workers, metrics=None, initializer=None, initargs=(), warmup=False, autoscale=None,
+                 max_pending=None, submit_timeout=None):
+        self.metrics = _make_metrics(metrics)
+        self.limiter = _make_limiter(max_pending, submit_timeout)
+        self.autoscaler = None
+
+        if autoscale is not None:
+            n_workers = autoscale.initial_workers(n_workers)
+
+        self.exec = _executor(n_workers, initializer, initargs, warmup, elastic=autoscale is not None)
+
+        if autoscale is not None:
+            self.autoscaler = _Autoscaler(autoscale, self.exec.resize, n_workers)
 
     def submit(self, fn, *args, **kwargs):
         """
@@ -74,34 +315,65 @@ class ThreadExecutor(Executor):
         10
         
         """
-        return _ThreadFuture(self.exec.submit(fn, *args, **kwargs))
+        return _submit(self.exec, self.metrics, fn, args, kwargs, self.autoscaler, self.limiter)
 
-    def map(self, func, *iterables, timeout=None, chunksize=1):
-        """
+    def shutdown(self, wait=True, *, cancel_futures=False):
+        if self.autoscaler is not None:
+            self.autoscaler.close()
 
-        Examples
-        --------
+        return _shutdown(self.exec, wait, cancel_futures)
 
-        >>> from apool import Executor, Thread
-        >>> from apool.testing import add
 
-        >>> with Executor(Thread, 5) as p:
-        ...     iter = p.map(add, [1, 2, 3, 4], [1, 2, 3, 4]) 
-        ...     list(iter)
-        [2, 4, 6, 8]
-        
-        """
-        return self.exec.map(func, *iterables, timeout=timeout, chunksize=chunksize)
+class ThreadPool(Pool):
+    """Custom pool that creates multiple threads instead of processess
 
-    def shutdown(self, wait=True, *, cancel_futures=False):
-        return self.exec.shutdown(wait=wait)
+    Parameters
+    ----------
+    n_workers: int
+        number of threads, defaults to the default of :class:`concurrent.futures.ThreadPoolExecutor`
 
+    metrics: bool or Metrics
+        collect metrics about the tasks, see :class:`apool.metrics.Metrics`
 
-class ThreadPool(Pool):
-    """Custom pool that creates multiple threads instead of processess"""
+    initializer: callable
+        called with ``initargs`` when a thread starts, see :func:`apool.worker_state`
+
+    initargs: tuple
+        arguments of the initializer
 
-    def __init__(self, n_workers):
-        self.pool = ThreadPoolExecutor(n_workers)
+    warmup: bool
+        start all the threads and block until they have run their initializer
+
+    autoscale: Autoscale
+        resize the pool with its load, ``n_workers`` is the initial number of threads,
+        see :class:`apool.autoscale.Autoscale`
+
+    max_pending: int
+        maximum number of tasks submitted and not finished yet, submitting more blocks
+
+    submit_timeout: float
+        time to wait for a task to finish when ``max_pending`` are pending,
+        0 raises :class:`queue.Full` right away and None waits forever
+    """
+
+    def __init__(self, n_workers, metrics=None, initializer=None, initargs=(), warmup=False, autoscale=None,
+                 max_pending=None, submit_timeout=None):
+        self.metrics = _make_metrics(metrics)
+        self.limiter = _make_limiter(max_pending, submit_timeout)
+        self.autoscaler = None
+
+        if autoscale is not None:
+            n_workers = autoscale.initial_workers(n_workers)
+
+        self.pool = _executor(n_workers, initializer, initargs, warmup, elastic=autoscale is not None)
+
+        if autoscale is not None:
+            # chunks are sized for the largest pool
+            self.n_workers = autoscale.max_workers
+            self.autoscaler = _Autoscaler(autoscale, self.pool.resize, n_workers)
+        else:
+            # None picks the default number of threads of the executor
+            self.n_workers = self.pool._max_workers
 
     def apply_async(self, fun, args, kwds=None) -> Future:
         """
@@ -121,13 +393,19 @@ class ThreadPool(Pool):
         if kwds is None:
             kwds = dict()
         
-        return _ThreadFuture(self.pool.submit(fun, *args, **kwds))
+        return _submit(self.pool, self.metrics, fun, args, kwds, self.autoscaler, self.limiter)
+
+    def _stop(self, wait=True, cancel=False):
+        if self.autoscaler is not None:
+            self.autoscaler.close()
+
+        _shutdown(self.pool, wait, cancel)
 
     def close(self):
-        self.pool.shutdown()
+        self._stop(wait=False)
 
     def terminate(self):
-        self.pool.shutdown()
+        self._stop(cancel=True)
 
     def join(self):
-        self.pool.shutdown()
+        self._stop()
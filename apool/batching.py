@@ -0,0 +1,321 @@
+"""Coalesce the submissions of tiny tasks into batches
+
+Submitted calls are buffered until ``max_batch`` of them are waiting or the oldest one
+waited for ``max_delay`` seconds, the buffer is then sent as a single task
+that runs the calls in a loop on the worker. Each call still gets its own future.
+
+Examples
+--------
+
+>>> from apool import Executor, Thread
+>>> from apool.batching import BatchingExecutor
+>>> from apool.testing import inc
+
+>>> with BatchingExecutor(Executor(Thread, 2), max_batch=16) as p:
+...     futures = [p.submit(inc, i) for i in range(64)]
+...     [f.get() for f in futures][:4], p.batches < 64
+([1, 2, 3, 4], True)
+
+With ``batch_fn`` the function receives all the arguments of a batch at once
+
+>>> def double(values):
+...     return [v * 2 for v in values]
+
+>>> with BatchingExecutor(Executor(Thread, 2), batch_fn=double) as p:
+...     list(p.map(None, range(4)))
+[0, 2, 4, 6]
+
+"""
+from concurrent.futures import CancelledError
+from threading import Condition, Event, Lock, Thread
+import time
+
+from apool.graph import _DeferredFuture, _has_futures
+from apool.interfaces import Executor, Future
+
+
+def _run_batch(calls):
+    """Run the calls of a batch, one failure does not fail the others"""
+    outcomes = []
+
+    for fun, args, kwargs in calls:
+        try:
+            outcomes.append((True, fun(*args, **kwargs)))
+        except Exception as exc:
+            outcomes.append((False, exc))
+
+    return outcomes
+
+
+def _run_vectorized(batch_fn, values, collate):
+    if collate is not None:
+        values = collate(values)
+
+    results = batch_fn(values)
+
+    if len(results) != len(values):
+        raise ValueError(f'batch_fn returned {len(results)} results for {len(values)} inputs')
+
+    return [(True, r) for r in results]
+
+
+class _Batch:
+    """Calls sent together, their futures wait on the batch"""
+
+    __slots__ = ('calls', 'futures', 'outcomes', 'done', 'lock')
+
+    def __init__(self):
+        self.calls = []
+        self.futures = []
+        self.outcomes = None
+        self.done = Event()
+        self.lock = Lock()
+
+    def add(self, call):
+        future = _BatchFuture(self, len(self.calls))
+        self.calls.append(call)
+        self.futures.append(future)
+        return future
+
+    def pending(self):
+        """Returns the indices of the calls that were not cancelled"""
+        return [i for i, call in enumerate(self.calls) if call is not None]
+
+    def finish(self, indices, future):
+        outcomes = [(False, CancelledError())] * len(self.futures)
+
+        if future.successful():
+            for i, outcome in zip(indices, future.get()):
+                outcomes[i] = outcome
+        else:
+            try:
+                future.get()
+            except BaseException as exc:
+                for i in indices:
+                    outcomes[i] = (False, exc)
+
+        self.set(outcomes)
+
+    def set(self, outcomes):
+        with self.lock:
+            self.outcomes = outcomes
+            self.done.set()
+
+        for future in self.futures:
+            callbacks, future.callbacks = future.callbacks, None
+
+            for callback in callbacks or ():
+                callback(future)
+
+
+class _BatchFuture(Future):
+    """Future of a single call of a batch"""
+
+    __slots__ = ('batch', 'index', 'callbacks')
+
+    def __init__(self, batch, index):
+        self.batch = batch
+        self.index = index
+        self.callbacks = None
+
+    def get(self, timeout=None):
+        if self.cancelled():
+            raise CancelledError()
+
+        if not self.batch.done.wait(timeout):
+            raise TimeoutError()
+
+        success, value = self.batch.outcomes[self.index]
+
+        if not success:
+            raise value
+
+        return value
+
+    def wait(self, timeout=None):
+        self.batch.done.wait(timeout)
+
+    def ready(self):
+        return self.batch.done.is_set()
+
+    def successful(self):
+        if not self.batch.done.is_set():
+            raise ValueError()
+
+        return self.batch.outcomes[self.index][0]
+
+    def add_done_callback(self, fn):
+        with self.batch.lock:
+            if self.batch.outcomes is None:
+                if self.callbacks is None:
+                    self.callbacks = []
+
+                self.callbacks.append(fn)
+                return
+
+        fn(self)
+
+    def cancel(self, interrupt=False):
+        # calls can only be removed from batches that were not sent yet
+        with self.batch.lock:
+            if self.batch.outcomes is not None or self.batch.calls is None:
+                return False
+
+            self.batch.calls[self.index] = None
+            return True
+
+    def cancelled(self):
+        batch = self.batch
+
+        if batch.done.is_set():
+            return isinstance(batch.outcomes[self.index][1], CancelledError)
+
+        calls = batch.calls
+        return calls is not None and calls[self.index] is None
+
+
+class BatchingExecutor(Executor):
+    """Executor sending batches of calls to another executor
+
+    Parameters
+    ----------
+    executor: Executor
+        executor running the batches
+
+    max_batch: int
+        maximum number of calls in a batch
+
+    max_delay: float
+        maximum time a call waits for its batch to fill up (s)
+
+    batch_fn: callable
+        vectorized function, called on the worker with the list of the arguments of a batch
+        and returning one result per argument. The function given to ``submit`` is ignored,
+        calls with more than one argument pass a tuple
+
+    collate: callable
+        converts the list of arguments before ``batch_fn`` is called, for example ``numpy.asarray``
+    """
+
+    def __init__(self, executor, max_batch=64, max_delay=0.001, batch_fn=None, collate=None):
+        self.executor = executor
+        self.metrics = executor.metrics
+        self.max_batch = max_batch
+        self.max_delay = max_delay
+        self.batch_fn = batch_fn
+        self.collate = collate
+        self.batches = 0
+        self.condition = Condition()
+        self.batch = None
+        self.deadline = None
+        self.running = True
+        self.thread = Thread(target=self._run, name='apool-batching', daemon=True)
+        self.thread.start()
+
+    def submit(self, fn, *args, **kwargs):
+        if _has_futures(args, kwargs):
+            return _DeferredFuture(lambda args, kwargs: self.submit(fn, *args, **kwargs), args, kwargs)
+
+        if self.batch_fn is not None:
+            call = args[0] if len(args) == 1 and not kwargs else args
+        else:
+            call = fn, args, kwargs
+
+        full = None
+
+        with self.condition:
+            if not self.running:
+                raise RuntimeError('cannot schedule new futures after shutdown')
+
+            if self.batch is None:
+                self.batch = _Batch()
+                self.deadline = time.monotonic() + self.max_delay
+                self.condition.notify()
+
+            future = self.batch.add(call)
+
+            if len(self.batch.calls) >= self.max_batch:
+                full, self.batch = self.batch, None
+
+        if full is not None:
+            self._send(full)
+
+        return future
+
+    def _run(self):
+        with self.condition:
+            while self.running:
+                if self.batch is None:
+                    self.condition.wait()
+                    continue
+
+                remaining = self.deadline - time.monotonic()
+
+                if remaining > 0:
+                    self.condition.wait(remaining)
+                    continue
+
+                batch, self.batch = self.batch, None
+
+                self.condition.release()
+                try:
+                    self._send(batch)
+                finally:
+                    self.condition.acquire()
+
+    def _send(self, batch):
+        with batch.lock:
+            indices = batch.pending()
+            calls = [batch.calls[i] for i in indices]
+            # cancelling is not possible once sent
+            batch.calls = None
+
+        self.batches += 1
+
+        if not calls:
+            return batch.set([(False, CancelledError())] * len(batch.futures))
+
+        if self.batch_fn is not None:
+            future = self.executor.submit(_run_vectorized, self.batch_fn, calls, self.collate)
+        else:
+            future = self.executor.submit(_run_batch, calls)
+
+        future.add_done_callback(lambda f: batch.finish(indices, f))
+
+    def broadcast(self, obj):
+        return self.executor.broadcast(obj)
+
+    def register(self, fn):
+        self.executor.register(fn)
+
+    def flush(self):
+        """Send the calls that are waiting for their batch to fill up"""
+        with self.condition:
+            batch, self.batch = self.batch, None
+
+        if batch is not None:
+            self._send(batch)
+
+    def shutdown(self, wait=True, *, cancel_futures=False):
+        with self.condition:
+            if not self.running:
+                return
+
+            self.running = False
+            batch, self.batch = self.batch, None
+            self.condition.notify()
+
+        if batch is not None:
+            if cancel_futures:
+                for future in batch.futures:
+                    future.cancel()
+
+            self._send(batch)
+
+        self.executor.shutdown(wait, cancel_futures=cancel_futures)
+
+    def stats(self):
+        return self.executor.stats()
+
+    def export_trace(self, path):
+        self.executor.export_trace(path)
@@ -0,0 +1,419 @@
+"""Memoization of the results of a pool, for every backend
+
+Results are identified by a hash of the function and of the pickled arguments,
+the same task submitted twice while the first one is running shares its future.
+Cached results are shared, they should not be modified.
+
+Examples
+--------
+
+>>> from apool import Pool, Thread
+>>> from apool.cache import CachedPool
+>>> from apool.testing import slow_inc
+
+>>> with CachedPool(Pool(Thread, 2), maxsize=128) as p:
+...     a = p.apply_async(slow_inc, (1, 0.1))
+...     b = p.apply_async(slow_inc, (1, 0.1))
+...     a is b, a.get(), p.apply(slow_inc, (1, 0.1))
+...     p.cache_info()
+(True, 2, 2)
+CacheInfo(hits=1, misses=1, deduplicated=1, size=1, nbytes=None)
+
+Results can be kept on disk, in a sqlite database or in a directory
+
+>>> import os
+>>> import tempfile
+>>> path = os.path.join(tempfile.mkdtemp(), 'results.sqlite')
+
+>>> with CachedPool(Pool(Thread, 2), disk=path) as p:
+...     p.map(slow_inc, range(4))
+[1, 2, 3, 4]
+>>> with CachedPool(Pool(Thread, 2), disk=path) as p:
+...     p.map(slow_inc, range(4)), p.cache_info().hits
+([1, 2, 3, 4], 4)
+
+"""
+from collections import OrderedDict, namedtuple
+import hashlib
+import os
+import pickle
+import sqlite3
+import tempfile
+from threading import Event, Lock
+import time
+
+from apool.interfaces import Future, Pool
+from apool.utils import _pickle
+
+
+CacheInfo = namedtuple('CacheInfo', ['hits', 'misses', 'deduplicated', 'size', 'nbytes'])
+CacheInfo.__doc__ = """Statistics of a :class:`CachedPool`, ``nbytes`` is None unless ``max_bytes`` is set"""
+
+
+class _DoneFuture(Future):
+    """Future of a result found in the cache"""
+
+    __slots__ = ('value',)
+
+    def __init__(self, value):
+        self.value = value
+
+    def get(self, timeout=None):
+        return self.value
+
+    def wait(self, timeout=None):
+        pass
+
+    def ready(self):
+        return True
+
+    def successful(self):
+        return True
+
+    def add_done_callback(self, fn):
+        fn(self)
+
+    def cancel(self, interrupt=False):
+        return False
+
+    def cancelled(self):
+        return False
+
+
+class _Reservation:
+    """Key of a task being submitted, identical tasks wait for its future"""
+
+    __slots__ = ('done', 'future')
+
+    def __init__(self):
+        self.done = Event()
+        self.future = None
+
+    def set(self, future):
+        """Called with the future of the task, None if it could not be submitted"""
+        self.future = future
+        self.done.set()
+
+    def wait(self):
+        self.done.wait()
+        return self.future
+
+
+class _SqliteStore:
+    """Results saved in a sqlite database"""
+
+    def __init__(self, path):
+        self.lock = Lock()
+        self.db = sqlite3.connect(path, check_same_thread=False)
+
+        with self.lock, self.db:
+            self.db.execute('CREATE TABLE IF NOT EXISTS results (key TEXT PRIMARY KEY, expires REAL, value BLOB)')
+
+    def get(self, key):
+        with self.lock:
+            row = self.db.execute('SELECT expires, value FROM results WHERE key = ?', (key,)).fetchone()
+
+        if row is None:
+            return None
+
+        return row[0], row[1]
+
+    def put(self, key, expires, data):
+        with self.lock, self.db:
+            self.db.execute('INSERT OR REPLACE INTO results VALUES (?, ?, ?)', (key, expires, data))
+
+    def delete(self, key):
+        with self.lock, self.db:
+            self.db.execute('DELETE FROM results WHERE key = ?', (key,))
+
+    def close(self):
+        with self.lock:
+            self.db.close()
+
+
+class _DirectoryStore:
+    """Results saved in a directory, one file per result"""
+
+    def __init__(self, path):
+        self.path = path
+        os.makedirs(path, exist_ok=True)
+
+    def get(self, key):
+        try:
+            with open(os.path.join(self.path, key), 'rb') as file:
+                data = file.read()
+        except FileNotFoundError:
+            return None
+
+        expires, data = pickle.loads(data)
+        return expires, data
+
+    def put(self, key, expires, data):
+        # write then rename so readers never see a partial file
+        fd, tmp = tempfile.mkstemp(dir=self.path)
+        with os.fdopen(fd, 'wb') as file:
+            file.write(pickle.dumps((expires, data), protocol=pickle.HIGHEST_PROTOCOL))
+        os.replace(tmp, os.path.join(self.path, key))
+
+    def delete(self, key):
+        try:
+            os.remove(os.path.join(self.path, key))
+        except FileNotFoundError:
+            pass
+
+    def close(self):
+        pass
+
+
+def _make_store(disk):
+    if disk is None or not isinstance(disk, str):
+        return disk
+
+    if disk.endswith(('.sqlite', '.sqlite3', '.db')):
+        return _SqliteStore(disk)
+
+    return _DirectoryStore(disk)
+
+
+class CachedPool(Pool):
+    """Pool that memoizes the results of another pool
+
+    Only successful results are cached, failed tasks are submitted again.
+    Map functions submit one task per element so each element is cached on its own.
+
+    Parameters
+    ----------
+    pool: Pool
+        pool running the tasks that are not in the cache
+
+    maxsize: int
+        maximum number of results kept in memory, least recently used results are evicted first
+
+    max_bytes: int
+        maximum size of the pickled results kept in memory
+
+    ttl: float
+        time after which a result expires (s)
+
+    disk: str
+        results are also saved on disk, a path ending with ``.sqlite``, ``.sqlite3`` or ``.db``
+        is a sqlite database, others are directories with one file per result.
+        Disk entries are only removed once they expire
+    """
+
+    def __init__(self, pool, maxsize=1024, max_bytes=None, ttl=None, disk=None):
+        self.pool = pool
+        self.n_workers = pool.n_workers
+        self.metrics = pool.metrics
+        self.maxsize = maxsize
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self.store = _make_store(disk)
+        self.lock = Lock()
+        # key -> (value, expires, nbytes)
+        self.results = OrderedDict()
+        self.inflight = dict()
+        self.functions = OrderedDict()
+        self.nbytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.deduplicated = 0
+
+    def key(self, fun, args, kwds):
+        """Returns the key of a task, None if it cannot be pickled"""
+        try:
+            digest = self._function_digest(fun)
+            data = pickle.dumps((args, sorted(kwds.items())), protocol=pickle.HIGHEST_PROTOCOL)
+        except Exception:
+            return None
+
+        return hashlib.sha256(digest + data).hexdigest()
+
+    def _function_digest(self, fun):
+        try:
+            with self.lock:
+                digest = self.functions.get(fun)
+        except TypeError:
+            return hashlib.sha256(_pickle(fun)).digest()
+
+        if digest is None:
+            digest = hashlib.sha256(_pickle(fun)).digest()
+
+            with self.lock:
+                self.functions[fun] = digest
+
+                if len(self.functions) > self.maxsize:
+                    self.functions.popitem(last=False)
+
+        return digest
+
+    def apply_async(self, fun, args, kwds=None) -> Future:
+        if kwds is None:
+            kwds = dict()
+
+        key = self.key(fun, args, kwds)
+
+        if key is None:
+            return self.pool.apply_async(fun, args, kwds)
+
+        while True:
+            now = time.time()
+
+            with self.lock:
+                entry = self.results.get(key)
+
+                if entry is not None and (entry[1] is None or entry[1] > now):
+                    self.results.move_to_end(key)
+                    self.hits += 1
+                    return _DoneFuture(entry[0])
+
+                pending = self.inflight.get(key)
+
+            if pending is None:
+                found = self._load(key, now)
+                if found is not None:
+                    return found
+
+                with self.lock:
+                    # an identical task might have been submitted while we looked on disk
+                    pending = self.inflight.get(key)
+
+                    if pending is None:
+                        self.misses += 1
+                        reservation = self.inflight[key] = _Reservation()
+                        break
+
+            future = pending.wait() if isinstance(pending, _Reservation) else pending
+
+            if future is not None:
+                with self.lock:
+                    self.deduplicated += 1
+
+                return future
+
+            # the submission of the identical task failed, try again
+
+        # submitting can block with max_pending, the lock is not held meanwhile
+        try:
+            future = self.pool.apply_async(fun, args, kwds)
+        except BaseException:
+            with self.lock:
+                self.inflight.pop(key, None)
+
+            reservation.set(None)
+            raise
+
+        with self.lock:
+            self.inflight[key] = future
+
+        reservation.set(future)
+        future.add_done_callback(lambda f: self._on_done(key, f))
+        return future
+
+    def _load(self, key, now):
+        if self.store is None:
+            return None
+
+        entry = self.store.get(key)
+
+        if entry is None:
+            return None
+
+        expires, data = entry
+        if expires is not None and expires <= now:
+            self.store.delete(key)
+            return None
+
+        value = pickle.loads(data)
+
+        with self.lock:
+            self.hits += 1
+            self._insert(key, value, expires, len(data))
+
+        return _DoneFuture(value)
+
+    def _on_done(self, key, future):
+        if not future.successful():
+            with self.lock:
+                self.inflight.pop(key, None)
+            return
+
+        value = future.get()
+        expires = None if self.ttl is None else time.time() + self.ttl
+        data = None
+
+        if self.store is not None or self.max_bytes is not None:
+            try:
+                data = pickle.dumps(value, protocol=pickle.HIGHEST_PROTOCOL)
+            except Exception:
+                with self.lock:
+                    self.inflight.pop(key, None)
+                return
+
+        if self.store is not None:
+            self.store.put(key, expires, data)
+
+        with self.lock:
+            self.inflight.pop(key, None)
+            self._insert(key, value, expires, None if data is None else len(data))
+
+    def _insert(self, key, value, expires, nbytes):
+        """Add a result to the memory tier and evict the old ones, the lock must be held"""
+        previous = self.results.pop(key, None)
+        if previous is not None and previous[2] is not None:
+            self.nbytes -= previous[2]
+
+        if self.max_bytes is not None and nbytes is not None and nbytes > self.max_bytes:
+            return
+
+        self.results[key] = value, expires, nbytes
+        self.nbytes += nbytes or 0
+
+        while self.results and (
+            len(self.results) > self.maxsize or (self.max_bytes is not None and self.nbytes > self.max_bytes)
+        ):
+            _, (_, _, size) = self.results.popitem(last=False)
+            self.nbytes -= size or 0
+
+    def cache_info(self):
+        """Returns the :class:`CacheInfo` of the cache"""
+        with self.lock:
+            nbytes = self.nbytes if self.max_bytes is not None else None
+            return CacheInfo(self.hits, self.misses, self.deduplicated, len(self.results), nbytes)
+
+    def cache_clear(self):
+        """Remove the results kept in memory"""
+        with self.lock:
+            self.results.clear()
+            self.nbytes = 0
+
+    def _submit_chunks(self, func, iterable, chunksize, ordered, speculative=None):
+        # chunks would be cached as a whole, elements are cached individually instead
+        return super()._submit_chunks(func, iterable, 1, ordered, speculative)
+
+    def _submit_lazy(self, func, iterable, chunksize, max_inflight, ordered, speculative=None):
+        return super()._submit_lazy(func, iterable, 1, max_inflight, ordered, speculative)
+
+    def broadcast(self, obj):
+        return self.pool.broadcast(obj)
+
+    def register(self, fun):
+        self.pool.register(fun)
+
+    def close(self):
+        self.pool.close()
+
+    def terminate(self):
+        self.pool.terminate()
+
+        if self.store is not None:
+            self.store.close()
+
+    def join(self):
+        self.pool.join()
+
+    def stats(self):
+        return self.pool.stats()
+
+    def export_trace(self, path):
+        self.pool.export_trace(path)
@@ -0,0 +1,238 @@
+"""Tasks depending on the results of other tasks
+
+Futures passed as arguments to ``apply_async`` or ``submit`` are replaced by their result,
+the task is submitted once all of them are done, without waiting in the caller.
+If one of them fails the task fails with the same exception.
+Only the futures found directly in the positional or keyword arguments are waited on.
+
+On dask the futures are given to dask, results stay on the workers.
+Other backends submit the task from the callback of its last dependency.
+
+Examples
+--------
+
+>>> from apool import Pool, Thread
+>>> from apool.testing import add, inc
+
+>>> with Pool(Thread, 2) as p:
+...     a = p.apply_async(inc, (1,))
+...     b = p.apply_async(add, (a, 10))
+...     b.get()
+12
+
+:class:`Graph` builds the tasks before running them
+
+>>> from apool.graph import Graph
+
+>>> graph = Graph()
+>>> a = graph.add(inc, 1)
+>>> b = graph.add(inc, a)
+>>> c = graph.add(add, a, b, name='total')
+
+>>> with Pool(Thread, 2) as p:
+...     futures = graph.run(p)
+...     futures[c].get(), futures['total'].get()
+(5, 5)
+
+"""
+from concurrent.futures import CancelledError
+from threading import Event, Lock
+
+from apool.interfaces import Future
+
+
+def _has_futures(args, kwds):
+    """Returns true if a task depends on other tasks"""
+    for arg in args:
+        if isinstance(arg, Future):
+            return True
+
+    if kwds:
+        for arg in kwds.values():
+            if isinstance(arg, Future):
+                return True
+
+    return False
+
+
+def _resolve(arg):
+    return arg.get() if isinstance(arg, Future) else arg
+
+
+class _DeferredFuture(Future):
+    """Future of a task submitted once the futures in its arguments are done
+
+    Parameters
+    ----------
+    submit: callable
+        called with the resolved ``args`` and ``kwds``, returns the future of the task
+    """
+
+    __slots__ = ('submit', 'args', 'kwds', 'lock', 'done', 'future', 'error', 'callbacks', 'waiting')
+
+    def __init__(self, submit, args, kwds):
+        self.submit = submit
+        self.args = args
+        self.kwds = kwds
+        self.lock = Lock()
+        self.done = Event()
+        self.future = None
+        self.error = None
+        self.callbacks = []
+
+        inputs = [arg for arg in (*args, *kwds.values()) if isinstance(arg, Future)]
+        self.waiting = len(inputs)
+
+        for future in inputs:
+            future.add_done_callback(self._on_input)
+
+    def _on_input(self, future):
+        if not future.successful():
+            try:
+                future.get()
+            except BaseException as exc:
+                return self._finish(exc)
+
+        with self.lock:
+            self.waiting -= 1
+
+            if self.waiting or self.error is not None:
+                return
+
+        try:
+            args = tuple(_resolve(arg) for arg in self.args)
+            kwds = {k: _resolve(v) for k, v in self.kwds.items()}
+            task = self.submit(args, kwds)
+        except BaseException as exc:
+            return self._finish(exc)
+
+        # the arguments are not needed anymore, release them
+        self.args = self.kwds = None
+
+        with self.lock:
+            cancelled = self.error is not None
+            self.future = task
+
+        if cancelled:
+            task.cancel()
+            return
+
+        task.add_done_callback(lambda _: self._finish())
+
+    def _finish(self, error=None):
+        with self.lock:
+            if self.done.is_set():
+                return
+
+            self.error = error
+            callbacks, self.callbacks = self.callbacks, None
+            self.done.set()
+
+        for callback in callbacks:
+            callback(self)
+
+    def get(self, timeout=None):
+        if not self.done.wait(timeout):
+            raise TimeoutError()
+
+        if self.error is not None:
+            raise self.error
+
+        return self.future.get()
+
+    def wait(self, timeout=None):
+        self.done.wait(timeout)
+
+    def ready(self):
+        return self.done.is_set()
+
+    def successful(self):
+        if not self.done.is_set():
+            raise ValueError()
+
+        return self.error is None and self.future.successful()
+
+    def add_done_callback(self, fn):
+        with self.lock:
+            if not self.done.is_set():
+                self.callbacks.append(fn)
+                return
+
+        fn(self)
+
+    def cancel(self, interrupt=False):
+        with self.lock:
+            task = self.future
+
+        if task is not None:
+            return task.cancel(interrupt)
+
+        if self.done.is_set():
+            return False
+
+        self._finish(CancelledError())
+        return True
+
+    def cancelled(self):
+        if isinstance(self.error, CancelledError):
+            return True
+
+        return self.done.is_set() and self.future is not None and self.future.cancelled()
+
+
+class Node:
+    """Task of a :class:`Graph`"""
+
+    __slots__ = ('fun', 'args', 'kwds', 'name')
+
+    def __init__(self, fun, args, kwds, name=None):
+        self.fun = fun
+        self.args = args
+        self.kwds = kwds
+        self.name = name
+
+    def __repr__(self):
+        name = self.name or getattr(self.fun, '__name__', repr(self.fun))
+        return f'Node({name})'
+
+
+class Graph:
+    """Tasks and their dependencies, nodes given as arguments to other nodes are replaced by their result.
+
+    Nodes can only depend on the nodes added before them so the graph never has cycles.
+    """
+
+    def __init__(self):
+        self.nodes = []
+
+    def add(self, fun, *args, name=None, **kwds):
+        """Add a task calling ``fun(*args, **kwds)``, returns its :class:`Node`"""
+        node = Node(fun, args, kwds, name)
+        self.nodes.append(node)
+        return node
+
+    def run(self, pool):
+        """Submit every task to a pool or an executor, dependents are submitted once their inputs are done.
+
+        Returns
+        -------
+        a dictionary of the futures of the tasks, indexed by node and by name
+        """
+        submit = getattr(pool, 'apply_async', None)
+
+        if submit is None:
+            def submit(fun, args, kwds):
+                return pool.submit(fun, *args, **kwds)
+
+        futures = dict()
+
+        for node in self.nodes:
+            args = tuple(futures[arg] if isinstance(arg, Node) else arg for arg in node.args)
+            kwds = {k: futures[v] if isinstance(v, Node) else v for k, v in node.kwds.items()}
+
+            future = futures[node] = submit(node.fun, args, kwds)
+
+            if node.name is not None:
+                futures[node.name] = future
+
+        return futures
@@ -1,7 +1,47 @@
+import asyncio
+from collections import deque
+from concurrent.futures import CancelledError
+from queue import SimpleQueue
+from threading import Event, Lock, Thread
+import time
+
+from apool.utils import _chunks, _get_chunksize, _map_chunk, _reduce_chunk
+
+
+# Default of the ``initial`` arguments, None is a valid initial value
+_NO_INITIAL = object()
+
+
+def _as_list(iterable):
+    if isinstance(iterable, (list, tuple)):
+        return iterable
+
+    return list(iterable)
 
 
 class Future:
-    """Generic Future interface"""
+    """Generic Future interface
+
+    Futures can be awaited, this does not block the event loop
+
+    Examples
+    --------
+
+    >>> import asyncio
+    >>> from apool import Pool, Thread
+    >>> from apool.testing import inc
+
+    >>> async def main(pool):
+    ...     return await asyncio.gather(pool.apply_async(inc, (1,)), pool.apply_async(inc, (2,)))
+
+    >>> with Pool(Thread, 2) as p:
+    ...     asyncio.run(main(p))
+    [2, 3]
+
+    """
+
+    # wrappers are created for every task, they do not need a __dict__
+    __slots__ = ()
 
     def get(self, timeout=None):
         """Retrieve the result"""
@@ -19,22 +59,118 @@ class Future:
         """Returns true if the underlying job did not raise an exception"""
         raise NotImplementedError()
 
+    def add_done_callback(self, fn):
+        """Call ``fn(future)`` once the underlying job has finished.
+        If the job has already finished ``fn`` is called right away.
+
+        The callback might be called from a background thread, it should not block.
+        """
+        raise NotImplementedError()
+
+    def cancel(self, interrupt=False):
+        """Cancel the job if it has not started yet, returns true if it was cancelled.
+        Cancelled futures are done and raise :class:`concurrent.futures.CancelledError`.
+
+        With ``interrupt`` a running job is stopped as well when the backend can do it,
+        the worker process running it is killed and replaced, coroutines are cancelled at their next ``await``.
+        Threads cannot be interrupted, dask forgets the job but lets its worker finish it.
+        """
+        raise NotImplementedError()
+
+    def cancelled(self):
+        """Returns true if the job was cancelled"""
+        raise NotImplementedError()
+
+    def __await__(self):
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+
+        def done(_):
+            loop.call_soon_threadsafe(_set_asyncio_future, future, self)
+
+        self.add_done_callback(done)
+        return future.__await__()
+
+
+def _set_asyncio_future(future, source):
+    if future.cancelled():
+        return
+
+    try:
+        future.set_result(source.get())
+    except BaseException as err:
+        future.set_exception(err)
+
 
 class FutureArray:
-    """Arrays of Futures"""
+    """Arrays of Futures
+
+    Parameters
+    ----------
+    futures: List[Future]
+        futures to wait on
+
+    ordered: bool
+        if true results are returned in submission order, else in completion order
 
-    def __init__(self, futures, ordered=True):
+    chunked: bool
+        if true each future returns a list of results that is flattened
+
+    """
+
+    def __init__(self, futures, ordered=True, chunked=False):
         self.futures = futures
         self.ordered = ordered
+        self.chunked = chunked
+        self.chunk = iter(())
+        self.completed = None
+        self.remaining = 0
+
+    def cancel(self, interrupt=False):
+        """Cancel the jobs that did not start yet, returns the number of cancelled jobs
+
+        Examples
+        --------
+
+        >>> import time
+        >>> from apool import Pool, Thread
+        >>> from apool.testing import slow_inc
+
+        >>> with Pool(Thread, 1) as p:
+        ...     futures = p.starmap_async(slow_inc, [(i, 0.1) for i in range(4)], chunksize=1)
+        ...     time.sleep(0.05)
+        ...     futures.cancel()
+        3
+
+        """
+        # done callbacks might remove futures while we iterate
+        return sum(bool(f.cancel(interrupt)) for f in list(self.futures))
 
     def get(self):
         """Wait for all our results and return them"""
+        if self.completed is not None:
+            return list(self)
+
+        if self.chunked:
+            return list(self.chunk) + [r for f in self.futures for r in f.get()]
+
         return [f.get() for f in self.futures]
 
     def __iter__(self):
         return self
 
     def __next__(self):
+        if not self.chunked:
+            return self.next_future()
+
+        while True:
+            try:
+                return next(self.chunk)
+            except StopIteration:
+                self.chunk = iter(self.next_future())
+
+    def next_future(self):
+        """Returns the result of the next future"""
         if self.ordered:
             return self.ordered_get()
         
@@ -45,34 +181,299 @@ class FutureArray:
         if not self.futures:
             raise StopIteration()
 
-        f = self.futures.pop(0)
-        return f.get()
+        if not isinstance(self.futures, deque):
+            # popping the head of a list is O(n), draining it would be O(n^2)
+            self.futures = deque(self.futures)
+
+        return self.futures.popleft().get()
 
     def unordered_get(self):
         """Get the first future that is ready"""
+        if self.completed is None:
+            # futures push themselves in the queue as they finish
+            self.completed = SimpleQueue()
+            self.remaining = len(self.futures)
+
+            for future in self.futures:
+                future.add_done_callback(self.completed.put)
+
+        if not self.remaining:
+            raise StopIteration()
+
+        self.remaining -= 1
+        return self.completed.get().get()
+
+
+class LazyFutureArray(FutureArray):
+    """Arrays of Futures that pulls its inputs lazily from an iterable
+    and keeps at most ``max_inflight`` tasks running at once.
+
+    New tasks are submitted as results are consumed, which bounds memory
+    and applies backpressure to the producer of the iterable.
+
+    Parameters
+    ----------
+    submit: Callable[[Any], Future]
+        function submitting one element of the iterable
+
+    iterable: Iterable
+        inputs, they can be infinite
+
+    max_inflight: int
+        maximum number of tasks submitted but not yet consumed
+
+    """
+
+    def __init__(self, submit, iterable, max_inflight, ordered=True, chunked=False):
+        super().__init__(deque(), ordered, chunked)
+        self.submit = submit
+        self.iterable = iter(iterable)
+        self.max_inflight = max(max_inflight, 1)
+
+        if not ordered:
+            self.completed = SimpleQueue()
+
+        self.fill()
+
+    def fill(self):
+        """Submit new tasks until ``max_inflight`` is reached"""
+        while self.iterable is not None and self.inflight() < self.max_inflight:
+            try:
+                item = next(self.iterable)
+            except StopIteration:
+                self.iterable = None
+                return
+
+            future = self.submit(item)
+
+            # unordered futures are kept until they are done so they can be cancelled
+            self.futures.append(future)
+
+            if not self.ordered:
+                self.remaining += 1
+                future.add_done_callback(self._on_done)
+
+    def _on_done(self, future):
+        self.futures.remove(future)
+        self.completed.put(future)
+
+    def inflight(self):
+        """Returns the number of tasks submitted but not yet consumed"""
+        if self.ordered:
+            return len(self.futures)
+
+        return self.remaining
+
+    def get(self):
+        """Wait for all the remaining results and return them"""
+        return list(self)
+
+    def cancel(self, interrupt=False):
+        """Stop pulling inputs and cancel the tasks that did not start yet,
+        returns the number of cancelled tasks"""
+        self.iterable = None
+        return super().cancel(interrupt)
+
+    def ordered_get(self):
         if not self.futures:
             raise StopIteration()
 
-        selected = None
+        future = self.futures.popleft()
+        self.fill()
+        return future.get()
+
+    def unordered_get(self):
+        if not self.remaining:
+            raise StopIteration()
 
-        while self.futures:
-            self.futures[0].wait(0.01)
+        future = self.completed.get()
+        self.remaining -= 1
+        self.fill()
+        return future.get()
+
+
+class _TreeReduce(Future):
+    """Future of a reduction, partial results are combined as they finish.
+
+    Parameters
+    ----------
+    apply_async: callable
+        submits the combination of two partial results to the workers, ``apply_async(reduce_fun, (a, b))``.
+        If None they are combined one after the other by a thread of this process,
+        never by the thread running the callbacks of the partial results
+
+    n: int
+        number of partial results that will be added
+    """
+
+    def __init__(self, apply_async, reduce_fun, n):
+        self.apply_async = apply_async
+        self.reduce_fun = reduce_fun
+        self.lock = Lock()
+        self.done = Event()
+        # partial results not done yet
+        self.outstanding = n
+        self.pending = set()
+        self.waiting = None
+        self.result = None
+        self.error = None
+        self.callbacks = []
+        self.partials = None
+
+        if apply_async is None:
+            self.partials = SimpleQueue()
+            Thread(target=self._combine, args=(n,), name='apool-reduce', daemon=True).start()
+
+    def add(self, future):
+        with self.lock:
+            self.pending.add(future)
+
+        future.add_done_callback(self._on_done)
+
+    def _on_done(self, future):
+        if not future.successful():
+            try:
+                future.get()
+            except BaseException as exc:
+                return self._finish(error=exc)
+
+        with self.lock:
+            self.pending.discard(future)
+
+        if self.partials is not None:
+            self.partials.put(future)
+        else:
+            self._merge(future)
+
+    def _combine(self, n):
+        result = _NO_INITIAL
+
+        for _ in range(n):
+            future = self.partials.get()
+
+            # woken up by a failure or a cancel
+            if future is None:
+                return
+
+            try:
+                value = future.get()
+                result = value if result is _NO_INITIAL else self.reduce_fun(result, value)
+            except BaseException as exc:
+                return self._finish(error=exc)
+
+        self._finish(result=result)
+
+    def _merge(self, partial):
+        with self.lock:
+            self.outstanding -= 1
+
+            if self.error is not None:
+                return
+
+            if self.waiting is None:
+                if self.outstanding:
+                    self.waiting = partial
+                    return
+
+                other = None
+            else:
+                other, self.waiting = self.waiting, None
+                self.outstanding += 1
+
+        if other is None:
+            return self._finish(result=partial)
+
+        try:
+            # futures are given as arguments so dask keeps the partial results on its workers
+            self.add(self.apply_async(self.reduce_fun, (other, partial)))
+        except BaseException as exc:
+            self._finish(error=exc)
+
+    def _finish(self, result=None, error=None):
+        with self.lock:
+            if self.done.is_set():
+                return
+
+            self.result = result
+            self.error = error
+            self.waiting = None
+            callbacks, self.callbacks = self.callbacks, None
+            self.done.set()
+
+        if error is not None and self.partials is not None:
+            self.partials.put(None)
+
+        for callback in callbacks:
+            callback(self)
 
-            for future in self.futures:
-                if future.ready():
-                    selected = future
-                    break
+    def get(self, timeout=None):
+        if not self.done.wait(timeout):
+            raise TimeoutError()
+
+        if self.error is not None:
+            raise self.error
+
+        if self.partials is not None:
+            return self.result
+
+        return self.result.get()
+
+    def wait(self, timeout=None):
+        self.done.wait(timeout)
+
+    def ready(self):
+        return self.done.is_set()
+
+    def successful(self):
+        if not self.done.is_set():
+            raise ValueError()
+
+        return self.error is None
+
+    def add_done_callback(self, fn):
+        with self.lock:
+            if not self.done.is_set():
+                self.callbacks.append(fn)
+                return
+
+        fn(self)
+
+    def cancel(self, interrupt=False):
+        with self.lock:
+            pending = list(self.pending)
+
+        if self.done.is_set():
+            return False
+
+        for future in pending:
+            future.cancel(interrupt)
+
+        self._finish(error=CancelledError())
+        return True
+
+    def cancelled(self):
+        return isinstance(self.error, CancelledError)
 
-            if selected:
-                break
 
-        self.futures.remove(selected)
-        return selected.get()
+def _map_results(futures, deadline):
+    # same semantics as concurrent.futures: the timeout runs from the call to map
+    try:
+        for future in futures.futures:
+            result = future.get(max(deadline - time.monotonic(), 0))
+
+            if futures.chunked:
+                yield from result
+            else:
+                yield result
+    finally:
+        futures.cancel()
 
 
 class Executor:
     """Simple executor interface"""
 
+    metrics = None
+
     def __init__(self, n_workers):
         pass
 
@@ -103,19 +504,84 @@ class Executor:
         [2, 4, 6, 8]
         
         """
-        return self.map_async(func, *iterables, timeout=timeout, chunksize=chunksize).get()
+        futures = self.map_async(func, *iterables, timeout=timeout, chunksize=chunksize)
+        if timeout is None:
+            return futures
+
+        return _map_results(futures, time.monotonic() + timeout)
     
     def map_async(self, func, *iterables, timeout=None, chunksize=1):
+        """
+
+        Examples
+        --------
+
+        >>> from apool import Executor, Thread
+        >>> from apool.testing import add
+
+        >>> with Executor(Thread, 5) as p:
+        ...     futures = p.map_async(add, [1, 2, 3, 4], [1, 2, 3, 4], chunksize=3)
+        ...     futures.get()
+        [2, 4, 6, 8]
+
+        """
+        if chunksize > 1:
+            futures = [self.submit(_map_chunk, func, chunk) for chunk in _chunks(zip(*iterables), chunksize)]
+            return FutureArray(futures, chunked=True)
+
         futures = [self.submit(func, *args) for args in zip(*iterables)]
         return FutureArray(futures)
 
     def shutdown(self, wait=True, *, cancel_futures=False):
         raise NotImplementedError()
 
+    def broadcast(self, obj):
+        """Returns a handle to pass to the tasks instead of ``obj``,
+        tasks receive ``obj`` in place of the handle.
+        Threads share a plain reference, other backends send ``obj`` once per worker instead of once per task.
+
+        Examples
+        --------
+
+        >>> from apool import Executor, Thread
+        >>> from apool.testing import add
+
+        >>> with Executor(Thread, 2) as p:
+        ...     table = p.broadcast(10)
+        ...     list(p.map(add, [1, 2], [table, table]))
+        [11, 12]
+
+        """
+        return obj
+
+    def register(self, fn):
+        """Serialize ``fn`` again, the tasks submitted after see the current state of a closure.
+        Process backends serialize the functions pickle cannot handle once, other backends ignore it.
+        """
+
+    def stats(self):
+        """Snapshot of the metrics, None if they are disabled, see :class:`apool.metrics.Metrics`"""
+        if self.metrics is None:
+            return None
+
+        return self.metrics.snapshot()
+
+    def export_trace(self, path):
+        """Write the trace of the tasks, see :meth:`apool.metrics.Metrics.export_trace`"""
+        if self.metrics is None:
+            raise RuntimeError('tracing is disabled, use metrics=Metrics(trace=True)')
+
+        self.metrics.export_trace(path)
+
 
 class Pool:
     """Basic Pool interface"""
 
+    metrics = None
+
+    # results stay on the workers until they are fetched
+    REMOTE_RESULTS = False
+
     def __init__(self, n_workers):
         self.n_workers = n_workers
 
@@ -147,7 +613,7 @@ class Pool:
     def apply_async(self, fun, args, kwds=None) -> Future:
         raise NotImplementedError()
 
-    def map(self, func, iterable):
+    def map(self, func, iterable, chunksize=None):
         """
 
         Examples
@@ -159,13 +625,28 @@ class Pool:
         >>> with Pool(Thread, 5) as p:
         ...     p.map(inc, (1, 2, 3, 4)) 
         [2, 3, 4, 5]
+
+        >>> with Pool(Thread, None) as p:
+        ...     p.map(inc, (1, 2, 3, 4))
+        [2, 3, 4, 5]
         
         """
-        return [self.apply(func, (arg,)) for arg in iterable]
+        # submit everything first, then gather so the workers run concurrently
+        return self.map_async(func, iterable, chunksize).get()
 
-    def map_async(self, func, iterable) -> FutureArray:
+    def map_async(self, func, iterable, chunksize=None, speculative=None) -> FutureArray:
         """
 
+        Parameters
+        ----------
+        chunksize: int
+            number of elements sent to a worker at once,
+            defaults to about 4 chunks per worker
+
+        speculative: bool or Speculate
+            run a copy of the chunks taking much longer than the others,
+            see :class:`apool.speculation.Speculate`
+
         Examples
         --------
  
@@ -176,12 +657,26 @@ class Pool:
         ...     future = p.map_async(inc, (1, 2, 3, 4)) 
         ...     future.get()
         [2, 3, 4, 5]
+
+        >>> with Pool(Thread, 5) as p:
+        ...     future = p.map_async(inc, range(10), chunksize=3)
+        ...     future.get()
+        [1, 2, 3, 4, 5, 6, 7, 8, 9, 10]
         
         """
-        return FutureArray([self.apply_async(func, (arg,)) for arg in iterable])
+        return self.starmap_async(func, [(arg,) for arg in iterable], chunksize, speculative)
 
-    def imap(self, func, iterable):
-        """
+    def imap(self, func, iterable, chunksize=1, max_inflight=None):
+        """Lazily apply ``func`` on each element of ``iterable``
+
+        Parameters
+        ----------
+        chunksize: int
+            number of elements sent to a worker at once
+
+        max_inflight: int
+            maximum number of chunks submitted but not consumed yet,
+            defaults to 4 per worker
 
         Examples
         --------
@@ -194,11 +689,30 @@ class Pool:
         ...     list(iter)
         [2, 3, 4, 5]
 
-        """
-        return self.map_async(func, iterable)
+        Infinite iterables are consumed on demand
+
+        >>> from itertools import count, islice
+
+        >>> with Pool(Thread, 2) as p:
+        ...     list(islice(p.imap(inc, count(), max_inflight=4), 5))
+        [1, 2, 3, 4, 5]
+
+        >>> with Pool(Thread, None) as p:
+        ...     list(p.imap(inc, range(3)))
+        [1, 2, 3]
 
-    def imap_unordered(self, func, iterable):
         """
+        return self._submit_lazy(func, ((arg,) for arg in iterable), chunksize, max_inflight, True)
+
+    def imap_unordered(self, func, iterable, chunksize=1, max_inflight=None, speculative=None):
+        """Lazily apply ``func`` on each element of ``iterable``,
+        results are returned as they finish
+
+        Parameters
+        ----------
+        speculative: bool or Speculate
+            run a copy of the chunks taking much longer than the others,
+            see :class:`apool.speculation.Speculate`
 
         Examples
         --------
@@ -207,14 +721,14 @@ class Pool:
         >>> from apool.testing import inc
 
         >>> with Pool(Thread, 5) as p:
-        ...     iter = p.imap_unordered(inc, (1, 2, 3, 4)) 
+        ...     iter = p.imap_unordered(inc, (1, 2, 3, 4), chunksize=2)
         ...     sorted(list(iter))
         [2, 3, 4, 5]
 
         """
-        return FutureArray([self.apply_async(func, (arg,)) for arg in iterable], False)
+        return self._submit_lazy(func, ((arg,) for arg in iterable), chunksize, max_inflight, False, speculative)
 
-    def starmap(self, func, iterable):
+    def starmap(self, func, iterable, chunksize=None):
         """
 
         Examples
@@ -228,9 +742,9 @@ class Pool:
         [3, 9]
         
         """
-        return [self.apply(func, args) for args in iterable]
+        return self.starmap_async(func, iterable, chunksize).get()
 
-    def starmap_async(self, func, iterable) -> FutureArray:
+    def starmap_async(self, func, iterable, chunksize=None, speculative=None) -> FutureArray:
         """
 
         Examples
@@ -245,7 +759,114 @@ class Pool:
         [3, 9]
         
         """
-        return FutureArray([self.apply_async(func, args) for args in iterable])
+        if chunksize is None:
+            iterable = _as_list(iterable)
+            chunksize = _get_chunksize(len(iterable), self.n_workers)
+
+        return self._submit_chunks(func, iterable, chunksize, True, speculative)
+
+    def map_reduce(self, map_fn, reduce_fn, iterable, initial=_NO_INITIAL, chunksize=None):
+        """Returns ``functools.reduce(reduce_fn, map(map_fn, iterable), initial)``, see :meth:`map_reduce_async`
+
+        Examples
+        --------
+
+        >>> from operator import add
+        >>> from apool import Pool, Thread
+        >>> from apool.testing import inc
+
+        >>> with Pool(Thread, 2) as p:
+        ...     p.map_reduce(inc, add, range(100)), p.map_reduce(inc, add, [], initial=0)
+        (5050, 0)
+
+        """
+        return self.map_reduce_async(map_fn, reduce_fn, iterable, initial, chunksize).get()
+
+    def map_reduce_async(self, map_fn, reduce_fn, iterable, initial=_NO_INITIAL, chunksize=None) -> Future:
+        """Map and reduce ``iterable`` on the workers, returns the future of the result
+
+        Each chunk is reduced by the worker mapping it, only one partial result per chunk
+        is sent back. The partial results are then combined two by two in the order they finish,
+        by a thread of this process as they arrive or, with dask, on the workers where they stay until the end.
+        ``reduce_fn`` must be associative and commutative, ``initial`` is only used once.
+
+        Parameters
+        ----------
+        chunksize: int
+            number of elements reduced by a worker at once,
+            defaults to about 4 chunks per worker
+        """
+        iterable = _as_list(iterable)
+
+        if chunksize is None:
+            chunksize = _get_chunksize(len(iterable), self.n_workers)
+
+        # an empty iterable still runs one task, it returns initial or raises like reduce
+        chunks = list(_chunks(iterable, chunksize)) or [[]]
+        initial = () if initial is _NO_INITIAL else (initial,)
+
+        # sending the partial results back to the workers would only copy them once more
+        future = _TreeReduce(self.apply_async if self.REMOTE_RESULTS else None, reduce_fn, len(chunks))
+
+        for i, chunk in enumerate(chunks):
+            future.add(self.apply_async(_reduce_chunk, (map_fn, reduce_fn, chunk, *(initial if i == 0 else ()))))
+
+        return future
+
+    def _submit_chunks(self, func, iterable, chunksize, ordered, speculative=None):
+        from apool.speculation import _make_speculator
+
+        apply_async = _make_speculator(speculative, self.apply_async, self.n_workers)
+
+        if chunksize > 1:
+            futures = [apply_async(_map_chunk, (func, chunk)) for chunk in _chunks(iterable, chunksize)]
+            return FutureArray(futures, ordered, chunked=True)
+
+        return FutureArray([apply_async(func, args) for args in iterable], ordered)
+
+    def _submit_lazy(self, func, iterable, chunksize, max_inflight, ordered, speculative=None):
+        if max_inflight is None:
+            # pools resolve a default number of workers, the fallback is for pools that do not
+            max_inflight = 4 * (self.n_workers or 1)
+
+        from apool.speculation import _make_speculator
+
+        apply_async = _make_speculator(speculative, self.apply_async, self.n_workers)
+
+        if chunksize > 1:
+            def submit(chunk):
+                return apply_async(_map_chunk, (func, chunk))
+
+            return LazyFutureArray(submit, _chunks(iterable, chunksize), max_inflight, ordered, chunked=True)
+
+        def submit(args):
+            return apply_async(func, args)
+
+        return LazyFutureArray(submit, iterable, max_inflight, ordered)
+
+    def broadcast(self, obj):
+        """Returns a handle to pass to the tasks instead of ``obj``,
+        tasks receive ``obj`` in place of the handle.
+        Threads share a plain reference, other backends send ``obj`` once per worker instead of once per task.
+
+        Examples
+        --------
+
+        >>> from apool import Pool, Thread
+        >>> from apool.testing import add
+
+        >>> with Pool(Thread, 2) as p:
+        ...     table = p.broadcast(10)
+        ...     p.starmap(add, [(1, table), (2, table)])
+        [11, 12]
+
+        """
+        return obj
+
+    def register(self, fun):
+        """Serialize ``fun`` again, the tasks submitted after see the current state of a closure.
+        Process backends serialize the functions pickle cannot handle once, other backends ignore it.
+        """
 
     def close(self):
         """Prevent new work from being inserted"""
@@ -258,3 +879,17 @@ class Pool:
     def join(self):
         """wait for all the workers to finish, need to call close first"""
         pass
+
+    def stats(self):
+        """Snapshot of the metrics, None if they are disabled, see :class:`apool.metrics.Metrics`"""
+        if self.metrics is None:
+            return None
+
+        return self.metrics.snapshot()
+
+    def export_trace(self, path):
+        """Write the trace of the tasks, see :meth:`apool.metrics.Metrics.export_trace`"""
+        if self.metrics is None:
+            raise RuntimeError('tracing is disabled, use metrics=Metrics(trace=True)')
+
+        self.metrics.export_trace(path)
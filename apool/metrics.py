@@ -0,0 +1,511 @@
+"""Opt-in metrics of the tasks executed by a pool or an executor
+
+Metrics are disabled by default, backends then skip all the bookkeeping.
+Pass ``metrics=True`` or a :class:`Metrics` instance to enable them.
+
+Examples
+--------
+
+>>> from apool import Pool, Thread
+>>> from apool.testing import inc
+
+>>> with Pool(Thread, 2, metrics=True) as p:
+...     p.map(inc, range(8))
+...     stats = p.stats()
+[1, 2, 3, 4, 5, 6, 7, 8]
+>>> stats['tasks']
+{'submitted': 8, 'running': 0, 'completed': 8, 'failed': 0, 'cancelled': 0}
+>>> stats['run_time']['count']
+8
+
+"""
+from bisect import bisect_left
+import json
+import math
+import os
+import tempfile
+from threading import Event, Lock, Thread, current_thread
+import time
+
+
+# Upper bounds of the histogram buckets
+TIME_BUCKETS = (1e-5, 1e-4, 1e-3, 1e-2, 1e-1, 1.0, 10.0, 100.0, math.inf)
+SIZE_BUCKETS = (1e2, 1e3, 1e4, 1e5, 1e6, 1e7, 1e8, 1e9, math.inf)
+
+# name: (unit, buckets)
+HISTOGRAMS = dict(
+    queue_wait=('seconds', TIME_BUCKETS),
+    run_time=('seconds', TIME_BUCKETS),
+    serialize=('seconds', TIME_BUCKETS),
+    deserialize=('seconds', TIME_BUCKETS),
+    bytes=('bytes', SIZE_BUCKETS),
+)
+
+
+class _TaskRecord:
+    """Timestamps of a single task, fields the backend cannot observe stay None.
+
+    ``dumps``/``loads`` are the serialization of the arguments,
+    ``result_dumps``/``result_loads`` the serialization of the result.
+    """
+
+    __slots__ = (
+        'name', 'submit',
+        'dumps_start', 'dumps_end', 'nbytes_in',
+        'loads_start', 'loads_end',
+        'worker', 'start', 'end',
+        'result_dumps_start', 'result_dumps_end', 'nbytes_out',
+        'result_loads_start', 'result_loads_end',
+    )
+
+    # fields filled by the worker on its copy of the record
+    REMOTE = (
+        'loads_start', 'loads_end', 'worker', 'start', 'end',
+        'result_dumps_start', 'result_dumps_end', 'nbytes_out',
+        'result_loads_start', 'result_loads_end',
+    )
+
+    def __init__(self, name=None, submit=None):
+        for field in self.__slots__:
+            setattr(self, field, None)
+
+        self.name = name
+        self.submit = submit
+
+    def __getstate__(self):
+        return tuple(getattr(self, name) for name in self.__slots__)
+
+    def __setstate__(self, state):
+        for name, value in zip(self.__slots__, state):
+            setattr(self, name, value)
+
+    def merge(self, other):
+        """Copy the fields observed on the worker"""
+        for name in self.REMOTE:
+            setattr(self, name, getattr(other, name))
+
+
+class _Result:
+    """Result of a task executed remotely, carries the record back"""
+
+    __slots__ = ('value', 'record', 'failed')
+
+    def __init__(self, value, record, failed=False):
+        self.value = value
+        self.record = record
+        self.failed = failed
+
+    def __reduce__(self):
+        return _Result, (self.value, self.record, self.failed)
+
+
+def _run(record, fun, args, kwargs, worker=None):
+    """Execute a task, saving when it started and finished"""
+    record.worker = worker or current_thread().name
+    record.start = time.time()
+
+    try:
+        return fun(*args, **kwargs)
+    finally:
+        record.end = time.time()
+
+
+async def _run_async(record, fun, args, kwargs):
+    """Execute a coroutine function, saving when it started and finished"""
+    record.worker = current_thread().name
+    record.start = time.time()
+
+    try:
+        return await fun(*args, **kwargs)
+    finally:
+        record.end = time.time()
+
+
+def _duration(start, end):
+    if start is None or end is None:
+        return None
+
+    return end - start
+
+
+def _sum(*values):
+    values = [v for v in values if v is not None]
+
+    if not values:
+        return None
+
+    return sum(values)
+
+
+class Histogram:
+    """Counts of observations per bucket, ``bounds`` are the upper bounds of the buckets"""
+
+    def __init__(self, bounds):
+        self.bounds = bounds
+        self.counts = [0] * len(bounds)
+        self.sum = 0
+        self.count = 0
+
+    def observe(self, value):
+        self.counts[bisect_left(self.bounds, value)] += 1
+        self.sum += value
+        self.count += 1
+
+    def snapshot(self):
+        """Cumulative counts keyed by the bucket upper bound, like prometheus"""
+        buckets = dict()
+        total = 0
+
+        for bound, count in zip(self.bounds, self.counts):
+            total += count
+            buckets['+Inf' if math.isinf(bound) else repr(bound)] = total
+
+        return dict(count=self.count, sum=self.sum, buckets=buckets)
+
+
+class Metrics:
+    """Task counters, histograms and per worker utilization
+
+    Parameters
+    ----------
+    sinks: list of callables
+        called with a snapshot on :meth:`flush`, see :class:`JsonLinesSink` and :class:`PrometheusSink`
+
+    interval: float
+        if set, flush every ``interval`` seconds from a background thread
+
+    trace: bool
+        keep the record of every task so they can be exported with :meth:`export_trace`
+
+    Notes
+    -----
+    ``running`` counts the tasks that were submitted but did not finish yet, queued or executing.
+    Serialization time and bytes are only observed by the process backend.
+    Worker utilization is the time spent running tasks over the lifetime of the metrics.
+
+    Examples
+    --------
+
+    >>> from apool import Pool, Process
+    >>> from apool.testing import inc
+
+    >>> snapshots = []
+    >>> with Metrics(sinks=[snapshots.append]) as metrics:
+    ...     with Pool(Process, 2, metrics=metrics) as p:
+    ...         p.map(inc, range(4))
+    [1, 2, 3, 4]
+    >>> snapshots[-1]['tasks']['completed']
+    4
+    >>> snapshots[-1]['bytes']['count'] > 0
+    True
+
+    """
+
+    def __init__(self, sinks=(), interval=None, trace=False):
+        self.sinks = list(sinks)
+        self.records = [] if trace else None
+        self.lock = Lock()
+        self.started = time.time()
+        self.submitted = 0
+        self.completed = 0
+        self.failed = 0
+        self.cancelled = 0
+        self.histograms = {name: Histogram(buckets) for name, (_, buckets) in HISTOGRAMS.items()}
+        self.workers = dict()
+        self.stopped = Event()
+        self.reporter = None
+
+        if interval is not None:
+            self.reporter = Thread(target=self._report, args=(interval,), name='apool-metrics', daemon=True)
+            self.reporter.start()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def _report(self, interval):
+        while not self.stopped.wait(interval):
+            self.flush()
+
+    def _submit(self, fun):
+        """Count a new task, returns its record"""
+        with self.lock:
+            self.submitted += 1
+
+        return _TaskRecord(getattr(fun, '__name__', None) or type(fun).__name__, time.time())
+
+    def _done(self, record, failed):
+        """Count a finished task and observe its timings"""
+        run_time = _duration(record.start, record.end)
+        observations = dict(
+            queue_wait=_duration(record.submit, record.start),
+            run_time=run_time,
+            serialize=_sum(
+                _duration(record.dumps_start, record.dumps_end),
+                _duration(record.result_dumps_start, record.result_dumps_end),
+            ),
+            deserialize=_sum(
+                _duration(record.loads_start, record.loads_end),
+                _duration(record.result_loads_start, record.result_loads_end),
+            ),
+            bytes=_sum(record.nbytes_in, record.nbytes_out),
+        )
+
+        with self.lock:
+            if failed:
+                self.failed += 1
+            else:
+                self.completed += 1
+
+            for name, value in observations.items():
+                if value is not None:
+                    self.histograms[name].observe(value)
+
+            if run_time is not None:
+                tasks, busy = self.workers.get(record.worker, (0, 0))
+                self.workers[record.worker] = tasks + 1, busy + run_time
+
+            if self.records is not None:
+                self.records.append(record)
+
+    def _cancel(self, record):
+        """Count a task cancelled before it finished, its timings are not observed"""
+        with self.lock:
+            self.cancelled += 1
+
+    def _observe(self, record, future):
+        """Count the task once ``future`` is done, returns the future"""
+        def done(f):
+            if f.cancelled():
+                self._cancel(record)
+            else:
+                self._done(record, not f.successful())
+
+        future.add_done_callback(done)
+        return future
+
+    def snapshot(self):
+        """Returns the current value of the metrics as a JSON serializable dictionary"""
+        now = time.time()
+        uptime = max(now - self.started, 1e-9)
+
+        with self.lock:
+            stats = dict(
+                time=now,
+                uptime=uptime,
+                tasks=dict(
+                    submitted=self.submitted,
+                    running=self.submitted - self.completed - self.failed - self.cancelled,
+                    completed=self.completed,
+                    failed=self.failed,
+                    cancelled=self.cancelled,
+                ),
+            )
+
+            for name, histogram in self.histograms.items():
+                stats[name] = histogram.snapshot()
+
+            stats['workers'] = {
+                str(worker): dict(tasks=tasks, busy=busy, utilization=busy / uptime)
+                for worker, (tasks, busy) in self.workers.items()
+            }
+
+        return stats
+
+    def flush(self):
+        """Send a snapshot to the sinks"""
+        if not self.sinks:
+            return
+
+        stats = self.snapshot()
+        for sink in self.sinks:
+            sink(stats)
+
+    def close(self):
+        """Stop the reporter thread and flush one last time"""
+        self.stopped.set()
+
+        if self.reporter is not None:
+            self.reporter.join()
+            self.reporter = None
+
+        self.flush()
+
+
+    def trace_events(self):
+        """Convert the task records to Chrome trace events, see :meth:`export_trace`"""
+        if self.records is None:
+            raise RuntimeError('tracing is disabled, use Metrics(trace=True)')
+
+        with self.lock:
+            records = list(self.records)
+
+        return _trace_events(records, self.started)
+
+    def export_trace(self, path):
+        """Write the tasks in the Chrome trace event format, it can be opened
+        with ``chrome://tracing`` or https://ui.perfetto.dev
+
+        The client track shows the serialization of the arguments and results,
+        each worker gets its own track with the deserialization, execution and
+        serialization of its tasks. The time tasks spent queued are shown as async slices.
+
+        Examples
+        --------
+
+        >>> import json, os, tempfile
+        >>> from apool import Pool, Process
+        >>> from apool.testing import inc
+
+        >>> with Pool(Process, 2, metrics=Metrics(trace=True)) as p:
+        ...     p.map(inc, range(4), chunksize=1)
+        ...     path = os.path.join(tempfile.mkdtemp(), 'trace.json')
+        ...     p.export_trace(path)
+        [1, 2, 3, 4]
+        >>> with open(path) as file:
+        ...     events = json.load(file)['traceEvents']
+        >>> sorted({e['name'] for e in events if e['ph'] == 'X'})
+        ['dumps', 'inc', 'loads', 'result dumps', 'result loads']
+
+        """
+        with open(path, 'w') as file:
+            json.dump(dict(traceEvents=self.trace_events(), displayTimeUnit='ms'), file)
+
+
+# trace process ids
+_CLIENT, _WORKERS = 0, 1
+
+# spans shown in the trace, (track, name, start field, end field)
+_SPANS = (
+    ('send', 'dumps', 'dumps_start', 'dumps_end'),
+    ('worker', 'loads', 'loads_start', 'loads_end'),
+    ('worker', None, 'start', 'end'),
+    ('worker', 'result dumps', 'result_dumps_start', 'result_dumps_end'),
+    ('receive', 'result loads', 'result_loads_start', 'result_loads_end'),
+)
+
+
+def _trace_events(records, origin):
+    def us(timestamp):
+        return (timestamp - origin) * 1e6
+
+    events = [
+        dict(ph='M', name='process_name', pid=_CLIENT, tid=0, args=dict(name='client')),
+        dict(ph='M', name='process_name', pid=_WORKERS, tid=0, args=dict(name='workers')),
+        dict(ph='M', name='thread_name', pid=_CLIENT, tid=0, args=dict(name='send')),
+        dict(ph='M', name='thread_name', pid=_CLIENT, tid=1, args=dict(name='receive')),
+    ]
+    tracks = dict(send=(_CLIENT, 0), receive=(_CLIENT, 1))
+    workers = dict()
+
+    for task, record in enumerate(records):
+        args = dict(task=task, nbytes_in=record.nbytes_in, nbytes_out=record.nbytes_out)
+
+        if record.worker not in workers:
+            workers[record.worker] = len(workers)
+            events.append(dict(
+                ph='M', name='thread_name', pid=_WORKERS, tid=workers[record.worker],
+                args=dict(name=str(record.worker)),
+            ))
+
+        tracks['worker'] = _WORKERS, workers[record.worker]
+
+        if record.start is not None:
+            queued = dict(cat='queue', name=record.name, id=task, pid=_CLIENT, tid=0)
+            events.append(dict(queued, ph='b', ts=us(record.submit)))
+            events.append(dict(queued, ph='e', ts=us(record.start)))
+
+        for track, name, start, end in _SPANS:
+            start, end = getattr(record, start), getattr(record, end)
+
+            if start is None or end is None:
+                continue
+
+            pid, tid = tracks[track]
+            events.append(dict(
+                ph='X', name=name or record.name, pid=pid, tid=tid,
+                ts=us(start), dur=(end - start) * 1e6, args=args,
+            ))
+
+    return events
+
+
+def _make_metrics(metrics):
+    """Backends accept None, True or a :class:`Metrics` instance"""
+    if metrics is True:
+        return Metrics()
+
+    return metrics or None
+
+
+def prometheus_text(stats, prefix='apool'):
+    """Format a snapshot using the prometheus text exposition format
+
+    Examples
+    --------
+
+    >>> metrics = Metrics()
+    >>> metrics._done(metrics._submit(print), failed=True)
+    >>> print(prometheus_text(metrics.snapshot()).splitlines()[5])
+    apool_tasks_failed_total 1
+
+    """
+    lines = []
+
+    def add(name, kind, samples):
+        lines.append(f'# TYPE {prefix}_{name} {kind}')
+        for suffix, labels, value in samples:
+            labels = ','.join(f'{k}="{v}"' for k, v in labels.items())
+            labels = f'{{{labels}}}' if labels else ''
+            lines.append(f'{prefix}_{name}{suffix}{labels} {value}')
+
+    tasks = stats['tasks']
+    for name in ('submitted', 'completed', 'failed', 'cancelled'):
+        add(f'tasks_{name}_total', 'counter', [('', {}, tasks[name])])
+
+    add('tasks_running', 'gauge', [('', {}, tasks['running'])])
+
+    for name, (unit, _) in HISTOGRAMS.items():
+        histogram = stats[name]
+        samples = [('_bucket', dict(le=le), count) for le, count in histogram['buckets'].items()]
+        samples.append(('_sum', {}, histogram['sum']))
+        samples.append(('_count', {}, histogram['count']))
+        add(f'{name}_{unit}', 'histogram', samples)
+
+    workers = stats['workers'].items()
+    add('worker_tasks_total', 'counter', [('', dict(worker=w), s['tasks']) for w, s in workers])
+    add('worker_busy_seconds_total', 'counter', [('', dict(worker=w), s['busy']) for w, s in workers])
+    add('worker_utilization', 'gauge', [('', dict(worker=w), s['utilization']) for w, s in workers])
+
+    return '\n'.join(lines) + '\n'
+
+
+class JsonLinesSink:
+    """Append each snapshot as a line of JSON to a file"""
+
+    def __init__(self, path):
+        self.path = path
+
+    def __call__(self, stats):
+        with open(self.path, 'a') as file:
+            file.write(json.dumps(stats) + '\n')
+
+
+class PrometheusSink:
+    """Write the latest snapshot in the prometheus text format,
+    suited for the textfile collector of the node exporter
+    """
+
+    def __init__(self, path, prefix='apool'):
+        self.path = path
+        self.prefix = prefix
+
+    def __call__(self, stats):
+        # write then rename so the collector never reads a partial file
+        fd, tmp = tempfile.mkstemp(dir=os.path.dirname(os.path.abspath(self.path)))
+        with os.fdopen(fd, 'w') as file:
+            file.write(prometheus_text(stats, self.prefix))
+
+        os.replace(tmp, self.path)
@@ -0,0 +1,149 @@
+"""Streaming pipelines, each stage running on its own pool
+
+Items go through the stages concurrently, an item is submitted to the next stage
+as soon as the previous one is done with it, see :mod:`apool.graph`.
+At most ``max_inflight`` items are between the input and the output,
+which bounds the queue of every stage and applies backpressure to the input.
+
+Examples
+--------
+
+>>> from apool import Thread
+>>> from apool.pipeline import Pipeline, Stage
+>>> from apool.testing import inc
+
+>>> with Pipeline([Stage(inc, Thread, 2, name='decode'), Stage(inc, Thread, 1, name='encode')]) as pipeline:
+...     list(pipeline.run(range(5)))
+...     [(s['name'], s['completed']) for s in pipeline.stats()]
+[2, 3, 4, 5, 6]
+[('decode', 5), ('encode', 5)]
+
+"""
+import time
+
+from apool import Pool, Thread
+from apool.interfaces import LazyFutureArray
+
+
+class Stage:
+    """Step of a :class:`Pipeline`
+
+    Parameters
+    ----------
+    fun: callable
+        called with each item, returns the item given to the next stage
+
+    backend: int
+        backend of the pool running the stage, ``Thread`` for I/O and ``Process`` for CPU bound stages
+
+    n_workers: int
+        number of workers of the stage
+
+    name: str
+        name of the stage in the stats, defaults to the name of ``fun``
+
+    options:
+        arguments of the pool, see :func:`apool.Pool`
+    """
+
+    def __init__(self, fun, backend=Thread, n_workers=1, name=None, **options):
+        self.fun = fun
+        self.backend = backend
+        self.n_workers = n_workers
+        self.name = name or getattr(fun, '__name__', repr(fun))
+        self.options = options
+
+    def make_pool(self):
+        """Returns the pool running the stage, with metrics unless they were disabled"""
+        options = dict(metrics=True)
+        options.update(self.options)
+        return Pool(self.backend, self.n_workers, **options)
+
+
+class Pipeline:
+    """Chain of stages, each with its own backend and number of workers
+
+    Parameters
+    ----------
+    stages: list of Stage
+        stages the items go through, in order
+
+    max_inflight: int
+        maximum number of items in the pipeline, defaults to twice the number of workers
+
+    ordered: bool
+        return the results in the order of the inputs, else as they finish
+    """
+
+    def __init__(self, stages, max_inflight=None, ordered=True):
+        if not stages:
+            raise ValueError('a pipeline needs at least one stage')
+
+        self.stages = list(stages)
+        self.pools = [stage.make_pool() for stage in self.stages]
+        self.ordered = ordered
+        self.max_inflight = max_inflight or 2 * sum(pool.n_workers or 1 for pool in self.pools)
+        self.started = time.time()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def submit(self, item):
+        """Send an item through every stage, returns the future of the last stage"""
+        future = item
+
+        for stage, pool in zip(self.stages, self.pools):
+            future = pool.apply_async(stage.fun, (future,))
+
+        return future
+
+    def run(self, iterable):
+        """Lazily send the items of ``iterable`` through the pipeline, returns an iterator of the results"""
+        return LazyFutureArray(self.submit, iterable, self.max_inflight, self.ordered)
+
+    def stats(self):
+        """Returns the stats of every stage, the stage with the highest ``utilization`` is the bottleneck
+
+        ``pending`` counts the items queued or running in the stage, ``throughput`` is in items per second
+        and ``utilization`` is the time spent running items over the time available to the workers
+        """
+        elapsed = max(time.time() - self.started, 1e-9)
+        stats = []
+
+        for stage, pool in zip(self.stages, self.pools):
+            snapshot = pool.stats()
+
+            if snapshot is None:
+                stats.append(dict(name=stage.name))
+                continue
+
+            tasks = snapshot['tasks']
+            busy = snapshot['run_time']['sum']
+            stats.append(dict(
+                name=stage.name,
+                workers=pool.n_workers,
+                completed=tasks['completed'],
+                failed=tasks['failed'],
+                pending=tasks['running'],
+                throughput=tasks['completed'] / elapsed,
+                utilization=busy / (elapsed * (pool.n_workers or 1)),
+            ))
+
+        return stats
+
+    def bottleneck(self):
+        """Returns the name of the busiest stage"""
+        stats = [s for s in self.stats() if 'utilization' in s]
+
+        if not stats:
+            return None
+
+        return max(stats, key=lambda s: s['utilization'])['name']
+
+    def close(self):
+        """Terminate the pools of the stages"""
+        for pool in self.pools:
+            pool.terminate()
@@ -0,0 +1,239 @@
+"""Speculative execution of the stragglers of a map
+
+Once enough tasks are done and workers are idle, tasks running for much longer
+than their finished peers get a copy submitted, the first copy to succeed wins
+and the other ones are cancelled, worker processes running them are killed.
+
+Tasks are assumed to start in submission order, a task starts once it is one
+of the first ``n_workers`` unfinished tasks.
+
+Examples
+--------
+
+>>> import time
+>>> from apool import Pool, Thread
+>>> from apool.speculation import Speculate
+>>> from apool.testing import straggler
+
+The first run of ``straggler(3, ...)`` is slow, its copy is not
+
+>>> with Pool(Thread, 2) as p:
+...     start = time.time()
+...     futures = p.starmap_async(straggler, [(i, 0.05, 1 if i == 3 else 0) for i in range(8)],
+...                               chunksize=1, speculative=Speculate(quantile=0.5, min_done=4))
+...     futures.get(), time.time() - start < 1
+([1, 2, 3, 4, 5, 6, 7, 8], True)
+
+"""
+from collections import OrderedDict
+from itertools import islice
+from threading import Event, Lock, Thread
+import time
+
+from apool.interfaces import Future
+
+
+class Speculate:
+    """Configuration of the speculative execution of a map
+
+    Parameters
+    ----------
+    quantile: float
+        quantile of the run time of the finished tasks used as reference
+
+    multiplier: float
+        a task gets a copy once it runs for longer than ``multiplier`` times the reference
+
+    min_done: int
+        number of finished tasks needed before launching copies
+
+    max_copies: int
+        maximum number of copies of a task
+
+    interval: float
+        time between two checks (s)
+    """
+
+    def __init__(self, quantile=0.75, multiplier=1.5, min_done=4, max_copies=1, interval=0.05):
+        if not 0 <= quantile <= 1:
+            raise ValueError('expected 0 <= quantile <= 1')
+
+        self.quantile = quantile
+        self.multiplier = multiplier
+        self.min_done = max(min_done, 1)
+        self.max_copies = max_copies
+        self.interval = interval
+
+
+def _make_speculator(speculative, submit, n_workers):
+    """Returns the function submitting tasks, ``speculative`` is None, True or a :class:`Speculate`"""
+    if not speculative:
+        return submit
+
+    if speculative is True:
+        speculative = Speculate()
+
+    return _Speculator(speculative, submit, n_workers).submit
+
+
+class _SpeculativeFuture(Future):
+    """Future of a task that can run multiple times, the first success wins.
+    If all the copies fail the first failure is raised.
+    """
+
+    __slots__ = ('submit', 'args', 'lock', 'done', 'copies', 'failed', 'winner', 'callbacks')
+
+    def __init__(self, submit, args):
+        self.submit = submit
+        self.args = args
+        self.lock = Lock()
+        self.done = Event()
+        self.copies = []
+        self.failed = []
+        self.winner = None
+        self.callbacks = []
+
+    def launch(self):
+        future = self.submit(*self.args)
+
+        with self.lock:
+            self.copies.append(future)
+
+        future.add_done_callback(self._on_done)
+
+    def _on_done(self, future):
+        with self.lock:
+            if self.winner is not None:
+                return
+
+            if not future.successful() and len(self.failed) + 1 < len(self.copies):
+                self.failed.append(future)
+                return
+
+            if not future.successful() and self.failed:
+                future = self.failed[0]
+
+            self.winner = future
+            losers = [f for f in self.copies if f is not future]
+            callbacks, self.callbacks = self.callbacks, None
+
+        for loser in losers:
+            loser.cancel(interrupt=True)
+
+        self.done.set()
+
+        for callback in callbacks:
+            callback(self)
+
+    def get(self, timeout=None):
+        if not self.done.wait(timeout):
+            raise TimeoutError()
+
+        return self.winner.get()
+
+    def wait(self, timeout=None):
+        self.done.wait(timeout)
+
+    def ready(self):
+        return self.done.is_set()
+
+    def successful(self):
+        if not self.done.is_set():
+            raise ValueError()
+
+        return self.winner.successful()
+
+    def add_done_callback(self, fn):
+        with self.lock:
+            if self.winner is None:
+                self.callbacks.append(fn)
+                return
+
+        fn(self)
+
+    def cancel(self, interrupt=False):
+        with self.lock:
+            copies = list(self.copies)
+
+        return all([f.cancel(interrupt) for f in copies])
+
+    def cancelled(self):
+        return self.done.is_set() and self.winner.cancelled()
+
+
+class _Speculator:
+    """Watches the tasks of a map from a background thread and launches copies of the stragglers"""
+
+    def __init__(self, config, submit, n_workers):
+        self.config = config
+        self.submit_copy = submit
+        self.n_workers = max(n_workers or 1, 1)
+        self.lock = Lock()
+        # unfinished tasks in submission order, mapped to when they started
+        self.pending = OrderedDict()
+        self.durations = []
+        self.copies = 0
+        self.thread = None
+
+    def submit(self, *args):
+        future = _SpeculativeFuture(self.submit_copy, args)
+
+        with self.lock:
+            self.pending[future] = time.monotonic() if len(self.pending) < self.n_workers else None
+
+            if self.thread is None:
+                self.thread = Thread(target=self._run, name='apool-speculation', daemon=True)
+                self.thread.start()
+
+        future.add_done_callback(self._done)
+        future.launch()
+        return future
+
+    def _done(self, future):
+        now = time.monotonic()
+
+        with self.lock:
+            start = self.pending.pop(future, None)
+
+            if start is not None:
+                self.durations.append(now - start)
+
+            self.copies -= len(future.copies) - 1
+
+            # the next queued task starts on the worker we freed
+            for other in islice(self.pending, self.n_workers):
+                if self.pending[other] is None:
+                    self.pending[other] = now
+
+    def _run(self):
+        while True:
+            time.sleep(self.config.interval)
+
+            with self.lock:
+                if not self.pending:
+                    self.thread = None
+                    return
+
+            self.step(time.monotonic())
+
+    def step(self, now):
+        config = self.config
+
+        with self.lock:
+            idle = self.n_workers - len(self.pending) - self.copies
+
+            if idle <= 0 or len(self.durations) < config.min_done:
+                return
+
+            durations = sorted(self.durations)
+            limit = durations[min(int(config.quantile * len(durations)), len(durations) - 1)] * config.multiplier
+
+            stragglers = [
+                future for future, start in islice(self.pending.items(), self.n_workers)
+                if start is not None and now - start > limit and len(future.copies) <= config.max_copies
+            ]
+            stragglers = stragglers[:idle]
+            self.copies += len(stragglers)
+
+        for future in stragglers:
+            future.launch()
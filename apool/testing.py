@@ -1,3 +1,6 @@
+import asyncio
+import sys
+import time
 
 
 def fun(a, b, c, d):
@@ -9,3 +12,35 @@ def inc(a):
 
 def add(a, b):
     return a + b
+
+def imported(module):
+    """Returns true if ``module`` was imported by the worker"""
+    return module in sys.modules
+
+def slow_inc(a, duration=0.01):
+    time.sleep(duration)
+    return a + 1
+
+async def async_inc(a, duration=0):
+    await asyncio.sleep(duration)
+    return a + 1
+
+def work(payload, duration=0, spin=True):
+    """Busy (or sleep) for ``duration`` seconds and send back ``payload``"""
+    if spin:
+        end = time.perf_counter() + duration
+        while time.perf_counter() < end:
+            pass
+    else:
+        time.sleep(duration)
+    return payload
+
+_seen = set()
+
+def straggler(a, duration=0.01, slow=1):
+    """Like ``slow_inc`` but the first call with ``a`` in a process sleeps for ``slow`` seconds"""
+    if a not in _seen:
+        _seen.add(a)
+        duration = max(duration, slow)
+    time.sleep(duration)
+    return a + 1
@@ -1,4 +1,21 @@
+from collections import ChainMap, OrderedDict
+import copyreg
+from functools import reduce
+import hashlib
+import io
+from itertools import islice
+from multiprocessing import current_process
+from multiprocessing.pool import ExceptionWithTraceback
+from multiprocessing.reduction import ForkingPickler
+import os
 import pickle
+from queue import Full
+import shutil
+import tempfile
+from threading import Lock, Semaphore
+import weakref
+
+from apool.metrics import _Result, _run
 
 try:
     import cloudpickle
@@ -8,10 +25,472 @@ except ImportError as e:
     HAS_CLOUDPIKLE = e
 
 
-def _payload(fun, args, kwargs):
-    return cloudpickle.dumps((fun, args, kwargs))
+# Buffers larger than this are sent out-of-band, without being copied into the pickle
+OUT_OF_BAND_THRESHOLD = 64 * 1024
+
+# Number of functions kept deserialized in each worker
+FUNCTION_CACHE_SIZE = 128
+
+# Number of broadcast objects kept deserialized in each worker
+BROADCAST_CACHE_SIZE = 16
+
+# worker side caches of the objects loaded from a store, by kind, with their maximum size
+_loaded = dict(
+    function=(OrderedDict(), FUNCTION_CACHE_SIZE),
+    broadcast=(OrderedDict(), BROADCAST_CACHE_SIZE),
+)
+
+
+def _load_stored(path, digest, kind):
+    """Load an object from a :class:`_Store`, deserializing it only once per worker"""
+    cache, maxsize = _loaded[kind]
+    obj = cache.get(digest, cache)
+
+    if obj is not cache:
+        cache.move_to_end(digest)
+        return obj
+
+    with open(os.path.join(path, digest), 'rb') as file:
+        obj = pickle.load(file)
+
+    cache[digest] = obj
+
+    if len(cache) > maxsize:
+        cache.popitem(last=False)
+
+    return obj
+
+
+class _StoredRef:
+    """Handle to an object saved by a :class:`_Store`, this is what gets sent to the workers
+    instead of the object itself. Workers unpickle it as the object, wherever it is in the task"""
+
+    __slots__ = ('path', 'digest', 'kind')
+
+    def __init__(self, path, digest, kind):
+        self.path = path
+        self.digest = digest
+        self.kind = kind
+
+    def __reduce__(self):
+        return _load_stored, (self.path, self.digest, self.kind)
+
+    def get(self):
+        """Returns the object"""
+        return _load_stored(self.path, self.digest, self.kind)
+
+
+class _Store:
+    """Serialized objects saved in a temporary directory, identified by the hash of their content.
+    Workers load each of them once and keep it in the cache of its ``kind``.
+
+    The directory is created on first use and removed on :meth:`close` or when the store is collected.
+
+    Examples
+    --------
+
+    >>> store = _Store('broadcast')
+    >>> ref = store.put(_pickle(dict(a=1)))
+    >>> pickle.loads(pickle.dumps([ref, ref]))
+    [{'a': 1}, {'a': 1}]
+    >>> store.close()
+
+    """
+
+    def __init__(self, kind):
+        self.kind = kind
+        self.path = None
+        self.lock = Lock()
+
+    def put(self, data, digest=None):
+        """Save ``data`` unless it is already stored, returns a reference to it"""
+        if digest is None:
+            digest = _digest(data)
+
+        with self.lock:
+            if self.path is None:
+                self.path = tempfile.mkdtemp(prefix='apool-')
+                self.cleanup = weakref.finalize(self, shutil.rmtree, self.path, True)
+
+        filename = os.path.join(self.path, digest)
+
+        if not os.path.exists(filename):
+            # write then rename so workers never see a partial file
+            fd, tmp = tempfile.mkstemp(dir=self.path)
+            with os.fdopen(fd, 'wb') as file:
+                file.write(data)
+            os.replace(tmp, filename)
+
+        return _StoredRef(self.path, digest, self.kind)
+
+    def remove(self, digest):
+        try:
+            os.remove(os.path.join(self.path, digest))
+        except FileNotFoundError:
+            pass
+
+    def close(self):
+        """Remove the serialized objects"""
+        with self.lock:
+            if self.path is not None:
+                self.cleanup()
+                self.path = None
+
+
+def _digest(data):
+    return hashlib.sha1(data).hexdigest()
+
+
+def _pickle(obj):
+    """Serialize ``obj`` with pickle, cloudpickle is only used for objects pickle cannot handle"""
+    try:
+        return pickle.dumps(obj, protocol=pickle.HIGHEST_PROTOCOL)
+    except (pickle.PicklingError, AttributeError, TypeError):
+        if HAS_CLOUDPIKLE:
+            raise
+
+        return cloudpickle.dumps(obj)
+
+
+class _FunctionRegistry:
+    """Serialize the functions that pickle cannot handle (lambdas, closures, ...) once with cloudpickle,
+    identified by the hash of their serialized content.
+
+    The functions are saved in a :class:`_Store` that the workers load them from.
+    They are looked up by identity, so a closure keeps the state it had when it was first
+    registered until it is registered again with ``refresh``. Functions pickle can handle are sent as they are.
+    The file of a function is removed once it was evicted and no task using it is pending.
+
+    Examples
+    --------
+
+    >>> from apool.testing import inc
+    >>> registry = _FunctionRegistry()
+    >>> registry.register(inc) is inc
+    True
+
+    >>> state = dict(w=1)
+    >>> scale = lambda x: x * state['w']
+    >>> ref = registry.register(scale)
+    >>> registry.register(scale) is ref, pickle.loads(pickle.dumps(ref))(10)
+    (True, 10)
+
+    >>> state['w'] = 5
+    >>> registry.register(scale) is ref, pickle.loads(pickle.dumps(registry.register(scale, refresh=True)))(10)
+    (True, 50)
+    >>> registry.close()
+
+    """
+
+    def __init__(self, maxsize=FUNCTION_CACHE_SIZE):
+        self.store = _Store('function')
+        self.maxsize = maxsize
+        self.lock = Lock()
+        # function, or its id if it is not hashable -> (function, function or reference)
+        self.functions = OrderedDict()
+        # digest -> number of cache entries and pending tasks using the file
+        self.users = dict()
+
+    def _key(self, function):
+        try:
+            hash(function)
+        except TypeError:
+            # the entry keeps the function alive so its id is not reused
+            return id(function)
+
+        return function
+
+    def register(self, function, refresh=False, pending=False):
+        """Returns the function if pickle can serialize it, else a reference to its serialized content.
+
+        With ``pending`` the reference is used by a task and its file is kept until :meth:`release`.
+        """
+        key = self._key(function)
+
+        with self.lock:
+            entry = self.functions.get(key)
+
+            if entry is not None and not refresh:
+                self.functions.move_to_end(key)
+                return self._acquire(entry[1], pending)
+
+        value = function if _plain_picklable(function) else self._write(cloudpickle.dumps(function))
+
+        with self.lock:
+            previous = self.functions.pop(key, None)
+            self.functions[key] = (function, value)
+            self._acquire(value, pending)
+
+            if previous is not None:
+                self._release(previous[1])
+
+            if len(self.functions) > self.maxsize:
+                self._release(self.functions.popitem(last=False)[1][1])
+
+        return value
+
+    def _write(self, data):
+        digest = _digest(data)
+
+        # counted before writing so the file cannot be removed in between
+        with self.lock:
+            self.users[digest] = self.users.get(digest, 0) + 1
+
+        return self.store.put(data, digest)
+
+    def _acquire(self, value, pending):
+        """Count a task using a reference, the lock must be held"""
+        if pending and isinstance(value, _StoredRef):
+            self.users[value.digest] += 1
+
+        return value
+
+    def _release(self, value):
+        """Forget one user of a reference, its file is removed with the last one, the lock must be held"""
+        if not isinstance(value, _StoredRef):
+            return
+
+        count = self.users.pop(value.digest) - 1
+
+        if count:
+            self.users[value.digest] = count
+        else:
+            self.store.remove(value.digest)
+
+    def register_task(self, fun, args):
+        """Register ``fun`` and the functions given to the chunk helpers.
+
+        Returns ``fun``, ``args`` and the references the task uses, they must be given to
+        :meth:`release` once the task is done so their files are kept until then.
+        """
+        try:
+            n = _FUNCTION_ARGUMENTS.get(fun, 0)
+        except TypeError:
+            # not hashable, cannot be a chunk helper
+            n = 0
+
+        if n:
+            args = (*[self.register(f, pending=True) for f in args[:n]], *args[n:])
+
+        fun = self.register(fun, pending=True)
+        return fun, args, [f for f in (fun, *args[:n]) if isinstance(f, _StoredRef)]
+
+    def release(self, refs):
+        """Called once the task using ``refs`` is done"""
+        with self.lock:
+            for ref in refs:
+                self._release(ref)
+
+    def close(self):
+        """Remove the serialized functions"""
+        with self.lock:
+            self.functions.clear()
+            self.users.clear()
+
+        self.store.close()
+
+
+def _plain_picklable(function):
+    try:
+        pickle.dumps(function, protocol=pickle.HIGHEST_PROTOCOL)
+    except (pickle.PicklingError, AttributeError, TypeError):
+        return False
+
+    return True
+
+
+class _Pickler(pickle.Pickler):
+    """Pickler using the reducers registered to multiprocessing"""
+
+    dispatch_table = ChainMap(ForkingPickler._extra_reducers, copyreg.dispatch_table)
+
+
+def _dumps(obj):
+    """Serialize ``obj`` once using pickle protocol 5.
+
+    Plain pickle is tried first, cloudpickle is only used for objects it cannot handle.
+    Large contiguous buffers exposed through :class:`pickle.PickleBuffer`
+    (numpy arrays for example) are returned out-of-band so they can be sent
+    without being copied into the pickle.
+
+    Examples
+    --------
+
+    >>> from pickle import PickleBuffer
+    >>> large, small = bytearray(OUT_OF_BAND_THRESHOLD), bytearray(2)
+    >>> data, buffers = _dumps([PickleBuffer(large), PickleBuffer(small)])
+    >>> len(buffers)
+    1
+    >>> [len(memoryview(b)) for b in _loads(data, buffers)] == [OUT_OF_BAND_THRESHOLD, 2]
+    True
+
+    >>> data, buffers = _dumps(lambda x: x + 1)
+    >>> _loads(data, buffers)(1)
+    2
+
+    """
+    buffers = []
+
+    def buffer_callback(buffer):
+        if buffer.raw().nbytes < OUT_OF_BAND_THRESHOLD:
+            return True
+
+        buffers.append(buffer)
+
+    file = io.BytesIO()
+    try:
+        _Pickler(file, 5, buffer_callback=buffer_callback).dump(obj)
+
+    except (pickle.PicklingError, AttributeError, TypeError):
+        if HAS_CLOUDPIKLE:
+            raise
+
+        buffers = []
+        file = io.BytesIO()
+        cloudpickle.CloudPickler(file, 5, buffer_callback=buffer_callback).dump(obj)
+
+    return file.getbuffer(), buffers
+
+
+def _loads(data, buffers=()):
+    """Deserialize an object serialized by :func:`_dumps`"""
+    return pickle.loads(data, buffers=buffers)
+
+
+def _call(function, args, kwargs, record=None):
+    """Execute a task on a worker, with a record the result is sent back with the task timings"""
+    if record is None:
+        return function(*args, **kwargs)
+
+    try:
+        value = _run(record, function, args, kwargs, current_process().name)
+    except Exception as exc:
+        return _Result(ExceptionWithTraceback(exc, exc.__traceback__), record, failed=True)
+
+    return _Result(value, record)
+
+
+def _task_record(task):
+    """Returns the record of a task sent to a worker, tasks are ``(job, i, func, args, kwds)``"""
+    if task is None or task[2] is not _call or len(task[3]) < 4:
+        return None
+
+    return task[3][3]
+
+
+class _Limiter:
+    """Bounds the number of pending tasks of a pool, a slot is released once its task is done
+
+    Parameters
+    ----------
+    max_pending: int
+        maximum number of tasks submitted but not finished
+
+    timeout: float
+        time to wait for a free slot, None waits forever and 0 does not wait.
+        :class:`queue.Full` is raised when no slot was freed in time
+
+    Examples
+    --------
+
+    >>> from concurrent.futures import Future
+    >>> limiter = _Limiter(1, timeout=0)
+    >>> future = limiter(Future)
+    >>> limiter(Future)
+    Traceback (most recent call last):
+      ...
+    queue.Full: 1 tasks are pending
+    >>> future.set_result(None)
+    >>> limiter(Future).done()
+    False
+
+    """
+
+    def __init__(self, max_pending, timeout=None):
+        self.max_pending = max_pending
+        self.timeout = timeout
+        self.slots = Semaphore(max_pending)
+
+    def __call__(self, submit, *args, **kwargs):
+        """Call ``submit`` once a slot is free, returns its future"""
+        if not self.slots.acquire(timeout=self.timeout):
+            raise Full(f'{self.max_pending} tasks are pending')
+
+        try:
+            future = submit(*args, **kwargs)
+        except BaseException:
+            self.slots.release()
+            raise
+
+        future.add_done_callback(lambda _: self.slots.release())
+        return future
+
+
+def _make_limiter(max_pending, timeout=None):
+    if max_pending is None:
+        return None
+
+    return _Limiter(max_pending, timeout)
+
+
+def _get_chunksize(n_items, n_workers):
+    """Split the work in about 4 chunks per worker, same heuristic as :class:`multiprocessing.pool.Pool`
+
+    Examples
+    --------
+
+    >>> _get_chunksize(1000, 5)
+    50
+    >>> _get_chunksize(3, 5)
+    1
+
+    """
+    chunksize, extra = divmod(n_items, max(n_workers, 1) * 4)
+    if extra:
+        chunksize += 1
+    return max(chunksize, 1)
+
+
+def _chunks(iterable, chunksize):
+    """Split an iterable into lists of at most ``chunksize`` elements
+
+    Examples
+    --------
+
+    >>> list(_chunks(range(5), 2))
+    [[0, 1], [2, 3], [4]]
+
+    """
+    iterator = iter(iterable)
+
+    while True:
+        chunk = list(islice(iterator, chunksize))
+
+        if not chunk:
+            return
+
+        yield chunk
+
+
+def _map_chunk(fun, chunk):
+    """Execute a chunk of tasks in a single worker call,
+    the results are returned as a tuple which is not over allocated like a list"""
+    return tuple([fun(*args) for args in chunk])
+
+
+def _reduce_chunk(map_fun, reduce_fun, chunk, *initial):
+    """Map and reduce a chunk in a single worker call, only the partial result is sent back
+
+    Examples
+    --------
+
+    >>> from operator import add
+    >>> _reduce_chunk(abs, add, [-1, 2, -3], 10)
+    16
+
+    """
+    return reduce(reduce_fun, map(map_fun, chunk), *initial)
+
 
-def _cloudpickle(payload):
-    function, args, kwargs = pickle.loads(payload)
-    result = function(*args, **kwargs)
-    return cloudpickle.dumps(result)
+# Helpers receiving user functions as their first arguments, the functions are registered as well
+_FUNCTION_ARGUMENTS = {_map_chunk: 1, _reduce_chunk: 2}
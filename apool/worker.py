@@ -0,0 +1,75 @@
+"""State of the workers, shared by all the tasks a worker executes
+
+A worker is a process for the process backend, a thread for the thread based backends,
+the event loop for the asyncio backend and a dask worker for the dask backend.
+
+Examples
+--------
+
+>>> from apool import Pool, Thread, worker_state
+
+>>> def load(path):
+...     worker_state().model = f'model loaded from {path}'
+
+>>> def predict(x):
+...     return worker_state().model, x
+
+>>> with Pool(Thread, 2, initializer=load, initargs=('model.pt',), warmup=True) as p:
+...     p.apply(predict, (1,))
+('model loaded from model.pt', 1)
+
+"""
+from importlib import import_module
+import sys
+from threading import local
+from types import SimpleNamespace
+
+
+_local = local()
+
+
+def worker_state():
+    """Returns the state of the current worker, it is created on first use"""
+    distributed = sys.modules.get('distributed')
+
+    if distributed is not None:
+        try:
+            worker = distributed.get_worker()
+        except ValueError:
+            worker = None
+
+        if worker is not None:
+            if not hasattr(worker, 'apool_state'):
+                worker.apool_state = SimpleNamespace()
+
+            return worker.apool_state
+
+    state = getattr(_local, 'state', None)
+
+    if state is None:
+        state = _local.state = SimpleNamespace()
+
+    return state
+
+
+def _initialize(initializer, initargs, ready=None, preload=()):
+    """Import ``preload``, run the user initializer in a new worker and release ``ready`` once it is done"""
+    for module in preload:
+        import_module(module)
+
+    if initializer is not None:
+        initializer(*initargs)
+
+    if ready is not None:
+        ready.release()
+
+
+def _call_with_state(state, fun, *args, **kwargs):
+    """Execute ``fun`` with ``state`` as the state of the worker"""
+    previous = getattr(_local, 'state', None)
+    _local.state = state
+
+    try:
+        return fun(*args, **kwargs)
+    finally:
+        _local.state = previous
@@ -0,0 +1,62 @@
+"""Compare two runs of ``benchmarks.suite``
+
+.. code-block:: bash
+
+   python -m benchmarks.compare before.json after.json --threshold 0.1
+
+"""
+import argparse
+import json
+import sys
+
+
+KEYS = ('backend', 'api', 'duration', 'size', 'n_workers', 'n_tasks', 'spin')
+
+
+def load(path):
+    with open(path) as file:
+        data = json.load(file)
+
+    return data['meta'], {tuple(r[k] for k in KEYS): r for r in data['results'] if 'error' not in r}
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('before', type=str)
+    parser.add_argument('after', type=str)
+    parser.add_argument(
+        '--threshold', type=float, default=0.1,
+        help='relative throughput loss reported as a regression'
+    )
+    args = parser.parse_args(argv)
+
+    meta_before, before = load(args.before)
+    meta_after, after = load(args.after)
+    print(f'before: {meta_before["commit"]}')
+    print(f' after: {meta_after["commit"]}')
+    print()
+
+    header = f'{"backend":>9} {"api":>14} {"duration":>9} {"size":>8} {"workers":>7} {"before":>10} {"after":>10} {"ratio":>6}'
+    print(header)
+    print('-' * len(header))
+
+    regressions = 0
+    for key in sorted(before.keys() & after.keys(), key=str):
+        old, new = before[key]['throughput'], after[key]['throughput']
+        ratio = new / old
+        flag = ''
+
+        if ratio < 1 - args.threshold:
+            regressions += 1
+            flag = ' <'
+
+        backend, api, duration, size, n_workers = key[:5]
+        print(f'{backend:>9} {api:>14} {duration:>9g} {size:>8} {n_workers:>7} {old:>10.1f} {new:>10.1f} {ratio:>6.2f}{flag}')
+
+    print()
+    print(f'{regressions} regressions')
+    return 1 if regressions else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
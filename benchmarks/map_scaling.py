@@ -0,0 +1,70 @@
+"""Check that ``Pool.map`` throughput scales with the number of workers
+
+Each task sleeps for a fixed duration so the speedup is bounded by the
+number of workers and not by the GIL or the number of cores.
+
+.. code-block:: bash
+
+   python -m benchmarks.map_scaling --backend thread process --workers 1 2 4 8
+
+"""
+import argparse
+import sys
+import time
+
+from apool import Pool, Process, Thread, Dask
+from apool.testing import slow_inc
+
+
+BACKENDS = dict(process=Process, thread=Thread, dask=Dask)
+
+
+def measure(backend, n_workers, n_tasks, duration):
+    """Returns the number of task per second ``Pool.map`` achieved"""
+    with Pool(BACKENDS[backend], n_workers) as pool:
+        # first call pays for the worker startup
+        pool.map(slow_inc, range(n_workers))
+
+        start = time.perf_counter()
+        pool.starmap(slow_inc, [(i, duration) for i in range(n_tasks)])
+        elapsed = time.perf_counter() - start
+
+    return n_tasks / elapsed
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--backend', nargs='+', default=['thread', 'process'], choices=list(BACKENDS))
+    parser.add_argument('--workers', nargs='+', type=int, default=[1, 2, 4, 8])
+    parser.add_argument('--tasks', type=int, default=64)
+    parser.add_argument('--duration', type=float, default=0.01, help='time spent in each task (s)')
+    parser.add_argument(
+        '--min-efficiency', type=float, default=None,
+        help='exit with an error if speedup / n_workers falls below this value'
+    )
+    args = parser.parse_args(argv)
+
+    failed = False
+    print(f'{"backend":>8} {"workers":>8} {"task/s":>10} {"speedup":>8} {"efficiency":>10}')
+
+    for backend in args.backend:
+        baseline = None
+
+        for n_workers in args.workers:
+            throughput = measure(backend, n_workers, args.tasks, args.duration)
+
+            if baseline is None:
+                baseline = throughput / args.workers[0]
+
+            speedup = throughput / baseline
+            efficiency = speedup / n_workers
+            print(f'{backend:>8} {n_workers:>8} {throughput:>10.1f} {speedup:>8.2f} {efficiency:>10.2f}')
+
+            if args.min_efficiency is not None and efficiency < args.min_efficiency:
+                failed = True
+
+    return 1 if failed else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
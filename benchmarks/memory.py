@@ -0,0 +1,93 @@
+"""Measure the memory used per task and the time to drain a :class:`apool.interfaces.FutureArray`
+
+``bytes/task`` is the memory allocated by the parent for each finished task kept in a
+:class:`FutureArray`, futures and results included, measured with :mod:`tracemalloc`.
+``drain`` is the time to iterate over ``--drain`` finished futures in order.
+
+.. code-block:: bash
+
+   python -m benchmarks.memory --backend process thread --tasks 10000 100000
+
+"""
+import argparse
+import gc
+import sys
+import time
+import tracemalloc
+
+from apool import Pool, Process, Thread, Dask, Asyncio, WorkStealing
+from apool.interfaces import FutureArray, Future
+from apool.testing import inc
+
+
+BACKENDS = dict(process=Process, thread=Thread, dask=Dask, asyncio=Asyncio, stealing=WorkStealing)
+
+
+class _Done(Future):
+    """Finished future, isolates the cost of the array from the cost of the backend"""
+
+    __slots__ = ('value',)
+
+    def __init__(self, value):
+        self.value = value
+
+    def get(self, timeout=None):
+        return self.value
+
+
+def measure_tasks(pool, n_tasks, chunksize):
+    """Returns the bytes allocated per task once every task is done"""
+    gc.collect()
+    tracemalloc.start()
+    before = tracemalloc.get_traced_memory()[0]
+
+    if chunksize is None:
+        futures = FutureArray([pool.apply_async(inc, (i,)) for i in range(n_tasks)])
+    else:
+        futures = pool.map_async(inc, range(n_tasks), chunksize=chunksize)
+
+    for future in list(futures.futures):
+        future.wait()
+
+    gc.collect()
+    used = tracemalloc.get_traced_memory()[0] - before
+    tracemalloc.stop()
+
+    assert len(futures.get()) == n_tasks
+    return used / n_tasks
+
+
+def measure_drain(n_futures):
+    """Returns the time to consume ``n_futures`` finished futures in order"""
+    futures = FutureArray([_Done(i) for i in range(n_futures)])
+
+    start = time.perf_counter()
+    for _ in futures:
+        pass
+
+    return time.perf_counter() - start
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--backend', nargs='+', default=['process', 'thread'], choices=list(BACKENDS))
+    parser.add_argument('--tasks', nargs='+', type=int, default=[10000, 100000])
+    parser.add_argument('--workers', type=int, default=2)
+    parser.add_argument('--drain', type=int, default=1000000, help='number of futures drained')
+    args = parser.parse_args(argv)
+
+    print(f'{"backend":>10} {"tasks":>8} {"api":>12} {"bytes/task":>11}')
+
+    for name in args.backend:
+        with Pool(BACKENDS[name], args.workers) as pool:
+            for n_tasks in args.tasks:
+                for api, chunksize in (('apply_async', None), ('map', 64)):
+                    size = measure_tasks(pool, n_tasks, chunksize)
+                    print(f'{name:>10} {n_tasks:>8} {api:>12} {size:>11.1f}')
+
+    print(f'drain {args.drain} futures: {measure_drain(args.drain) * 1000:.1f}ms')
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
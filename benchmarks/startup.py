@@ -0,0 +1,72 @@
+"""Compare the startup time of the process pool for each start method
+
+Each method runs in a new interpreter since the fork server is started once per process.
+``first`` is the time until every worker of the first pool is ready, the fork server included,
+``next`` the same time for the pools created after it.
+
+.. code-block:: bash
+
+   python -m benchmarks.startup --method fork spawn forkserver --workers 1 4 --preload numpy
+
+"""
+import argparse
+import json
+import multiprocessing
+import subprocess
+import sys
+import time
+
+from apool import Pool, Process
+from apool.testing import inc
+
+
+def measure(method, n_workers, preload, repeat):
+    """Returns the time until the pool has returned its first results, for each pool"""
+    times = []
+
+    for _ in range(repeat):
+        start = time.perf_counter()
+
+        with Pool(Process, n_workers, context=method, preload=preload, warmup=True) as pool:
+            pool.map(inc, range(n_workers))
+            times.append(time.perf_counter() - start)
+
+    return times
+
+
+def run_isolated(method, n_workers, preload, repeat):
+    case = json.dumps(dict(method=method, n_workers=n_workers, preload=preload, repeat=repeat))
+    cmd = [sys.executable, '-m', 'benchmarks.startup', '--case', case]
+    out = subprocess.run(cmd, capture_output=True, text=True, check=True)
+    return json.loads(out.stdout.strip().splitlines()[-1])
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument(
+        '--method', nargs='+', default=multiprocessing.get_all_start_methods(),
+        choices=multiprocessing.get_all_start_methods()
+    )
+    parser.add_argument('--workers', nargs='+', type=int, default=[1, 4])
+    parser.add_argument('--preload', nargs='*', default=[], help='modules imported before running tasks')
+    parser.add_argument('--repeat', type=int, default=3, help='number of pools created per case')
+    parser.add_argument('--case', type=str, default=None, help=argparse.SUPPRESS)
+    args = parser.parse_args(argv)
+
+    if args.case is not None:
+        print(json.dumps(measure(**json.loads(args.case))))
+        return 0
+
+    print(f'{"method":>10} {"workers":>8} {"first":>8} {"next":>8}')
+
+    for method in args.method:
+        for n_workers in args.workers:
+            times = run_isolated(method, n_workers, args.preload, max(args.repeat, 2))
+            following = sorted(times[1:])[len(times[1:]) // 2]
+            print(f'{method:>10} {n_workers:>8} {times[0] * 1000:>6.1f}ms {following * 1000:>6.1f}ms')
+
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,195 @@
+"""Compare the backends across task duration, payload size, worker count and API
+
+Each case runs in its own process so its peak RSS (parent and largest worker) is isolated.
+Results are saved as JSON, use ``benchmarks.compare`` to compare two runs.
+
+.. code-block:: bash
+
+   python -m benchmarks.suite --output results.json
+   python -m benchmarks.suite --backend process thread --duration 1e-5 1e-3 --size 0 1000000
+
+"""
+import argparse
+from functools import partial
+from itertools import product
+import json
+import os
+import platform
+import resource
+import subprocess
+import sys
+import time
+
+from apool import Executor, Pool, Process, Thread, Dask, Asyncio, WorkStealing
+from apool.testing import work
+
+
+BACKENDS = dict(process=Process, thread=Thread, dask=Dask, asyncio=Asyncio, stealing=WorkStealing)
+APIS = ['apply_async', 'map', 'imap_unordered', 'executor_map']
+
+
+def percentile(values, q):
+    values = sorted(values)
+    if not values:
+        return None
+
+    return values[min(int(q * len(values)), len(values) - 1)]
+
+
+def _track(futures, start, latencies):
+    for future in futures:
+        future.add_done_callback(lambda _: latencies.append(time.perf_counter() - start))
+
+
+def run_api(pool, api, n_tasks, payload, duration, spin):
+    """Run the tasks, returns the latency of each result (or chunk of results)"""
+    latencies = []
+    start = time.perf_counter()
+
+    if api == 'apply_async':
+        futures = []
+        for _ in range(n_tasks):
+            submitted = time.perf_counter()
+            future = pool.apply_async(work, (payload, duration, spin))
+            _track([future], submitted, latencies)
+            futures.append(future)
+
+        for future in futures:
+            future.get()
+
+    elif api == 'map':
+        futures = pool.starmap_async(work, [(payload, duration, spin)] * n_tasks)
+        _track(futures.futures, start, latencies)
+        futures.get()
+
+    elif api == 'imap_unordered':
+        task = partial(work, duration=duration, spin=spin)
+
+        for _ in pool.imap_unordered(task, [payload] * n_tasks):
+            latencies.append(time.perf_counter() - start)
+
+    elif api == 'executor_map':
+        futures = pool.map_async(work, [payload] * n_tasks, [duration] * n_tasks, [spin] * n_tasks)
+        _track(futures.futures, start, latencies)
+        futures.get()
+
+    return time.perf_counter() - start, latencies
+
+
+def run_case(case):
+    """Run a single benchmark case in the current process"""
+    factory = Executor if case['api'] == 'executor_map' else Pool
+    payload = b'x' * case['size']
+
+    with factory(BACKENDS[case['backend']], case['n_workers']) as pool:
+        # warm up the workers
+        run_api(pool, case['api'], case['n_workers'], payload, 0, case['spin'])
+
+        elapsed, latencies = run_api(
+            pool, case['api'], case['n_tasks'], payload, case['duration'], case['spin']
+        )
+
+    self_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    children_rss = resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss
+
+    return dict(
+        case,
+        elapsed=elapsed,
+        throughput=case['n_tasks'] / elapsed,
+        p50=percentile(latencies, 0.50),
+        p99=percentile(latencies, 0.99),
+        # ru_maxrss is in KiB on linux, for children it is the largest one
+        peak_rss=self_rss * 1024,
+        peak_rss_worker=children_rss * 1024,
+    )
+
+
+def run_isolated(case, timeout):
+    """Run a case in a new interpreter"""
+    cmd = [sys.executable, '-m', 'benchmarks.suite', '--case', json.dumps(case)]
+
+    try:
+        out = subprocess.run(cmd, capture_output=True, text=True, timeout=timeout, check=True)
+        return json.loads(out.stdout.strip().splitlines()[-1])
+
+    except (subprocess.SubprocessError, json.JSONDecodeError, IndexError) as err:
+        return dict(case, error=f'{type(err).__name__}: {err}')
+
+
+def git_commit():
+    try:
+        cwd = os.path.dirname(os.path.abspath(__file__))
+        return subprocess.check_output(['git', 'rev-parse', 'HEAD'], cwd=cwd, text=True).strip()
+    except (subprocess.SubprocessError, OSError):
+        return None
+
+
+def fmt_time(value):
+    if value is None:
+        return '-'
+
+    for scale, unit in ((1, 's'), (1e-3, 'ms'), (1e-6, 'us')):
+        if value >= scale:
+            return f'{value / scale:.1f}{unit}'
+
+    return f'{value * 1e9:.0f}ns'
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--backend', nargs='+', default=['process', 'thread', 'stealing'], choices=list(BACKENDS))
+    parser.add_argument('--api', nargs='+', default=APIS, choices=APIS)
+    parser.add_argument('--duration', nargs='+', type=float, default=[1e-5, 1e-3, 1e-2], help='task duration (s)')
+    parser.add_argument('--size', nargs='+', type=int, default=[0, 100_000], help='argument and result size (bytes)')
+    parser.add_argument('--workers', nargs='+', type=int, default=[1, 4])
+    parser.add_argument('--tasks', type=int, default=200, help='number of tasks per case')
+    parser.add_argument('--sleep', action='store_true', help='sleep instead of spinning during the task')
+    parser.add_argument('--timeout', type=float, default=600, help='timeout of a single case (s)')
+    parser.add_argument('--output', type=str, default=None, help='JSON file to save the results to')
+    parser.add_argument('--case', type=str, default=None, help=argparse.SUPPRESS)
+    args = parser.parse_args(argv)
+
+    if args.case is not None:
+        print(json.dumps(run_case(json.loads(args.case))))
+        return 0
+
+    results = []
+    header = f'{"backend":>9} {"api":>14} {"duration":>9} {"size":>8} {"workers":>7} {"task/s":>10} {"p50":>8} {"p99":>8} {"rss":>7}'
+    print(header)
+    print('-' * len(header))
+
+    for backend, api, duration, size, n_workers in product(args.backend, args.api, args.duration, args.size, args.workers):
+        case = dict(
+            backend=backend, api=api, duration=duration, size=size,
+            n_workers=n_workers, n_tasks=args.tasks, spin=not args.sleep,
+        )
+        result = run_isolated(case, args.timeout)
+        results.append(result)
+
+        if 'error' in result:
+            print(f'{backend:>9} {api:>14} {fmt_time(duration):>9} {size:>8} {n_workers:>7} {result["error"]}')
+            continue
+
+        rss = (result['peak_rss'] + result['peak_rss_worker']) / 1024 ** 2
+        print(
+            f'{backend:>9} {api:>14} {fmt_time(duration):>9} {size:>8} {n_workers:>7} '
+            f'{result["throughput"]:>10.1f} {fmt_time(result["p50"]):>8} {fmt_time(result["p99"]):>8} {rss:>6.0f}M'
+        )
+
+    if args.output:
+        meta = dict(
+            commit=git_commit(),
+            time=time.time(),
+            python=sys.version,
+            platform=platform.platform(),
+            cpu_count=os.cpu_count(),
+        )
+
+        with open(args.output, 'w') as file:
+            json.dump(dict(meta=meta, results=results), file, indent=2)
+
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -13,4 +13,6 @@ if __name__ == '__main__':
             'apool.backends'
         ],
         setup_requires=['setuptools'],
+        # pickle protocol 5 out-of-band buffers
+        python_requires='>=3.8',
     )